@@ -1,4 +1,22 @@
 from .filepicker_client import FilepickerClient
 from .filepicker_file import FilepickerFile
+from .filepicker_fileset import FileSet
 from .filepicker_policy import FilepickerPolicy
+from .filepicker_session import FilepickerSession
+from .filepicker_signer import URLSigner
+from .filepicker_cache import MetadataCache, LRUMetadataCache
+from .filepicker_convert import Converter, ConversionCache
+from .filepicker_checkpoint import Checkpoint
+from .filepicker_content_cache import ContentCache
+from .filepicker_pipeline import GzipCompressor, GzipDecompressor
+from .filepicker_dedup import MemoryDedupIndex, SQLiteDedupIndex
+from .filepicker_metrics import (EventHooks, MetricsCollector,
+                                 MetricsExporter, LoggingExporter)
+from .filepicker_exceptions import FilepickerException, ChecksumMismatch
+from .filepicker_ratelimit import RateLimiter, AdaptiveConcurrencyLimiter
+from .filepicker_retry import RetryPolicy, CircuitBreaker, CircuitOpenError
 
+try:
+    from .filepicker_async import AsyncFilepickerClient, AsyncFilepickerFile
+except (ImportError, SyntaxError):
+    pass
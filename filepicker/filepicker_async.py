@@ -0,0 +1,289 @@
+import mimetypes
+import json
+import os
+
+try:
+    import urllib.parse as parser
+except ImportError:
+    import urllib as parser
+
+import aiohttp
+
+from .filepicker_client import FilepickerClient
+from .filepicker_download import DownloadResult, hexdigests, new_hashers
+from .filepicker_exceptions import FilepickerException
+from .filepicker_file import FilepickerFile
+from .filepicker_policy import FilepickerPolicy
+
+
+def _query(params):
+    return dict((k, v.decode('utf-8') if isinstance(v, bytes) else str(v))
+                for k, v in params.items() if v is not None)
+
+
+def _create_session(limit, limit_per_host):
+    connector = aiohttp.TCPConnector(limit=limit,
+                                     limit_per_host=limit_per_host)
+    return aiohttp.ClientSession(connector=connector)
+
+
+class AsyncFilepickerClient(object):
+
+    API_URL = FilepickerClient.API_URL
+    DEFAULT_LIMIT = 100
+
+    def __init__(self, api_key=None, storage='S3', app_secret=None,
+                 session=None, limit=DEFAULT_LIMIT, limit_per_host=0,
+                 metadata_cache=None):
+        self.set_api_key(api_key)
+        self.set_storage(storage)
+        self.set_app_secret(app_secret)
+        self.policies = {}
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self._session = session
+        self._owns_session = session is None
+        self.set_metadata_cache(metadata_cache)
+
+    def set_api_key(self, api_key):
+        self.api_key = api_key
+
+    def set_storage(self, storage):
+        self.storage = storage
+
+    def set_app_secret(self, secret):
+        self.app_secret = secret
+
+    def set_metadata_cache(self, metadata_cache):
+        self.metadata_cache = metadata_cache
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = _create_session(self.limit, self.limit_per_host)
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def store_from_url(self, url, storage=None, policy_name=None,
+                             **kwargs):
+        params = {}
+        data = {'url': url}
+        if policy_name:
+            params.update(self.policies[policy_name].signature_params())
+        if kwargs:
+            params.update(kwargs)
+        return await self.__post(storage, data=data, params=params)
+
+    async def store_local_file(self, filepath, storage=None,
+                               policy_name=None, **kwargs):
+        filename = os.path.basename(filepath)
+        mimetype = mimetypes.guess_type(filepath)[0]
+        params = {}
+        if policy_name:
+            params.update(self.policies[policy_name].signature_params())
+        if kwargs:
+            params.update(kwargs)
+        with open(filepath, 'rb') as f:
+            data = aiohttp.FormData()
+            data.add_field('fileUpload', f, filename=filename,
+                           content_type=mimetype)
+            return await self.__post(storage, data=data, params=params)
+
+    def add_policy(self, name, policy):
+        if self.app_secret is None:
+            raise Exception("Please set app secret first")
+        self.policies[name] = FilepickerPolicy(policy, self.app_secret)
+
+    async def __post(self, storage, data=None, params=None):
+        storage = storage or self.storage
+        post_url = '{}/store/{}'.format(self.API_URL, storage)
+        params['key'] = self.api_key
+        async with self.session.post(post_url, data=data,
+                                     params=_query(params)) as response:
+            text = await response.text()
+        try:
+            response_dict = json.loads(text)
+            return AsyncFilepickerFile(response_dict=response_dict,
+                                       api_key=self.api_key,
+                                       app_secret=self.app_secret,
+                                       policies=self.policies,
+                                       session=self.session,
+                                       metadata_cache=self.metadata_cache)
+        except ValueError:
+            return response
+
+
+class AsyncFilepickerFile(FilepickerFile):
+
+    __slots__ = ('_session', '_owns_session')
+
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, handle=None, url=None, response_dict=None,
+                 api_key=None, app_secret=None, policies=None,
+                 session=None, **kwargs):
+        super(AsyncFilepickerFile, self).__init__(
+            handle=handle, url=url, response_dict=response_dict,
+            api_key=api_key, app_secret=app_secret, policies=policies,
+            session=session, **kwargs)
+
+    def set_session(self, session):
+        self._session = session
+        self._owns_session = session is None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = _create_session(
+                AsyncFilepickerClient.DEFAULT_LIMIT, 0)
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def update_metadata(self, policy_name=None, fields=None):
+        params = self._metadata_params(policy_name, fields)
+        async with self.session.get(self.url + '/metadata',
+                                    params=_query(params)) as response:
+            if response.status < 400:
+                self._apply_metadata(await response.text(), fields)
+            return response
+
+    def _fetch_lazy(self, name):
+        raise FilepickerException(
+            'Lazy metadata is not available for async files, '
+            'await update_metadata(fields=...) instead')
+
+    async def delete(self, policy_name=None):
+        if self.api_key is None:
+            return "Please set API key first"
+        params = {'key': self.api_key}
+        if policy_name:
+            params.update(self.policies[policy_name].signature_params())
+        self._invalidate_caches()
+        async with self.session.delete(self.url,
+                                       params=_query(params)) as response:
+            await response.read()
+            return response
+
+    async def download(self, destination_path, policy_name=None,
+                       chunk_size=DOWNLOAD_CHUNK_SIZE):
+        url = self.get_signed_url(policy_name) if policy_name else self.url
+        with open(destination_path, 'wb') as f:
+            async with self.session.get(url) as response:
+                if response.status < 400:
+                    async for chunk in response.content.iter_chunked(
+                            chunk_size):
+                        f.write(chunk)
+                return response
+
+    async def download_to(self, fileobj, policy_name=None,
+                          chunk_size=DOWNLOAD_CHUNK_SIZE,
+                          hash_names=('md5',)):
+        hashers = new_hashers(hash_names)
+        url = self.get_signed_url(policy_name) if policy_name else self.url
+        size = 0
+        async with self.session.get(url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(chunk_size):
+                fileobj.write(chunk)
+                size += len(chunk)
+                for h in hashers.values():
+                    h.update(chunk)
+        return DownloadResult(response, size, hexdigests(hashers))
+
+    def iter_bytes(self, *args, **kwargs):
+        raise FilepickerException(
+            'iter_bytes is not available for async files, '
+            'await download_to() instead')
+
+    def read_into(self, *args, **kwargs):
+        raise FilepickerException(
+            'read_into is not available for async files, '
+            'await download_to() instead')
+
+    def download_pipelined(self, *args, **kwargs):
+        raise FilepickerException(
+            'download_pipelined is not available for async files, '
+            'await download() instead')
+
+    async def copy_to(self, storage='S3', path=None, policy_name=None,
+                      source_policy=None, **kwargs):
+        if self.api_key is None:
+            return "Please set API key first"
+        source = (self.get_signed_url(source_policy) if source_policy
+                  else self.url)
+        params = {'key': self.api_key}
+        if path:
+            params['path'] = path
+        if policy_name:
+            params.update(self.policies[policy_name].signature_params())
+        params.update(kwargs)
+        return await self.__post(self.STORE_API_URL + storage,
+                                 data={'url': source}, params=params)
+
+    async def overwrite(self, url=None, filepath=None, policy_name=None):
+        params = {}
+        if policy_name:
+            params.update(self.policies[policy_name].signature_params())
+        self._invalidate_caches()
+        if filepath:
+            filename = os.path.basename(filepath)
+            mimetype = mimetypes.guess_type(filepath)[0]
+            with open(filepath, 'rb') as f:
+                data = aiohttp.FormData()
+                data.add_field('fileUpload', f, filename=filename,
+                               content_type=mimetype)
+                return await self.__post(self.url, data=data, params=params)
+        return await self.__post(self.url, data={'url': url}, params=params)
+
+    async def convert(self, policy_name=None, **kwargs):
+        if self.temporary:
+            return "File already converted"
+
+        storing_options = ['filename', 'storeLocation', 'storePath',
+                           'storeContainer', 'storeAccess']
+        if policy_name:
+            kwargs.update(self.policies[policy_name].signature_params())
+
+        if set(storing_options) & set(kwargs.keys()):
+            if self.api_key is None:
+                return "Please set API key first"
+            kwargs['key'] = self.api_key
+            return await self.__post(self.url + '/convert', params=kwargs)
+
+        url = '{}/convert?{}'.format(self.url, parser.urlencode(kwargs))
+        return AsyncFilepickerFile(url=url, api_key=self.api_key,
+                                   app_secret=self.app_secret,
+                                   policies=self.policies,
+                                   session=self.session,
+                                   metadata_cache=self.metadata_cache,
+                                   temporary=True)
+
+    def _convert(self, *args, **kwargs):
+        raise FilepickerException(
+            'Converters are not available for async files, '
+            'await convert() instead')
+
+    async def __post(self, url, data=None, params=None):
+        async with self.session.post(url, data=data,
+                                     params=_query(params or {})) as r:
+            rd = json.loads(await r.text())
+        return AsyncFilepickerFile(
+                response_dict=rd, api_key=self.api_key,
+                app_secret=self.app_secret,
+                policies=self.policies,
+                session=self.session,
+                metadata_cache=self.metadata_cache)
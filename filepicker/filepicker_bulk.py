@@ -0,0 +1,90 @@
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .filepicker_checkpoint import Checkpoint
+
+
+BulkResult = namedtuple('BulkResult', ['item', 'result', 'error'])
+
+
+class BulkProgress(object):
+
+    def __init__(self, clock=time.time):
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.clock = clock
+        self.started = clock()
+
+    @property
+    def elapsed(self):
+        return self.clock() - self.started
+
+    @property
+    def throughput(self):
+        elapsed = self.elapsed
+        if elapsed <= 0:
+            return 0.0
+        return (self.completed + self.failed) / elapsed
+
+    def update(self, error=None):
+        if error is None:
+            self.completed += 1
+        else:
+            self.failed += 1
+
+
+def run_bulk(func, items, concurrency=8, max_in_flight=None):
+    max_in_flight = max(max_in_flight or concurrency * 2, concurrency)
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(func, item)] = item
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    yield BulkResult(item, future.result(), None)
+                else:
+                    yield BulkResult(item, None, error)
+
+
+def run_checkpointed(func, items, key, checkpoint=None, record=None,
+                     progress_callback=None, concurrency=8,
+                     max_in_flight=None):
+    if checkpoint is not None and not isinstance(checkpoint, Checkpoint):
+        checkpoint = Checkpoint(checkpoint)
+    progress = BulkProgress()
+
+    def pending(items):
+        for item in items:
+            if checkpoint is not None and key(item) in checkpoint:
+                progress.skipped += 1
+                continue
+            yield item
+
+    try:
+        for result in run_bulk(func, pending(items), concurrency=concurrency,
+                               max_in_flight=max_in_flight):
+            progress.update(result.error)
+            if result.error is None and checkpoint is not None:
+                checkpoint.record(key(result.item),
+                                  **(record(result) if record else {}))
+            if progress_callback:
+                progress_callback(progress)
+            yield result
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
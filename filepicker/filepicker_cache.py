@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class MetadataCache(object):
+
+    def __init__(self, event_hooks=None):
+        self.hits = 0
+        self.misses = 0
+        self.event_hooks = event_hooks
+        self._stats_lock = threading.Lock()
+
+    def get(self, handle):
+        metadata = self._get(handle)
+        with self._stats_lock:
+            if metadata is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if self.event_hooks is not None:
+            self.event_hooks.emit(
+                'cache_miss' if metadata is None else 'cache_hit',
+                cache=type(self).__name__, key=handle)
+        return metadata
+
+    def set(self, handle, metadata):
+        self._set(handle, dict(metadata))
+
+    def delete(self, handle):
+        self._delete(handle)
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def _get(self, handle):
+        raise NotImplementedError
+
+    def _set(self, handle, metadata):
+        raise NotImplementedError
+
+    def _delete(self, handle):
+        raise NotImplementedError
+
+
+class LRUMetadataCache(MetadataCache):
+
+    def __init__(self, max_size=10000, ttl=300, clock=time.time,
+                 event_hooks=None):
+        super(LRUMetadataCache, self).__init__(event_hooks=event_hooks)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, handle):
+        with self._lock:
+            entry = self._entries.pop(handle, None)
+            if entry is None:
+                return None
+            expires, metadata = entry
+            if self.ttl is not None and expires < self.clock():
+                return None
+            self._entries[handle] = entry
+            return dict(metadata)
+
+    def _set(self, handle, metadata):
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries.pop(handle, None)
+            self._entries[handle] = (expires, metadata)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _delete(self, handle):
+        with self._lock:
+            self._entries.pop(handle, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        stats = super(LRUMetadataCache, self).stats()
+        stats['size'] = len(self._entries)
+        return stats
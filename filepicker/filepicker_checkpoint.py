@@ -0,0 +1,53 @@
+import json
+import os
+import threading
+
+
+class Checkpoint(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.done = self._load()
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _load(self):
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                done[record['key']] = record
+        return done
+
+    def record(self, key, **data):
+        data['key'] = key
+        line = json.dumps(data, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write(line)
+            self._file.flush()
+            self.done[key] = data
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,255 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+
+import requests
+
+from .filepicker_bulk import BulkProgress, run_bulk
+from .filepicker_checkpoint import Checkpoint
+from .filepicker_client import FilepickerClient
+from .filepicker_exceptions import FilepickerException
+from .filepicker_file import FilepickerFile
+
+
+_client = None
+_options = None
+
+
+def read_manifest(path):
+    f = sys.stdin if path == '-' else open(path)
+    try:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            yield json.loads(line) if line.startswith('{') else line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def item_key(item):
+    if isinstance(item, dict):
+        return json.dumps(item, sort_keys=True, separators=(',', ':'))
+    return item
+
+
+def make_client(options):
+    client = FilepickerClient(api_key=options.api_key,
+                              storage=options.storage,
+                              app_secret=options.app_secret,
+                              pool_maxsize=options.threads)
+    if options.api_url:
+        client.API_URL = options.api_url
+    return client
+
+
+def _file(client, item, options):
+    if isinstance(item, dict):
+        handle, url = item.get('handle'), item.get('url')
+    elif '/' in item:
+        handle, url = None, item
+    else:
+        handle, url = item, None
+    if url is None and options.api_url:
+        handle, url = None, '{}/file/{}'.format(
+            options.api_url.rstrip('/'), handle)
+    return client.get_file(handle=handle, url=url)
+
+
+def upload(client, item, options):
+    file = client.store_item(item)
+    if not isinstance(file, FilepickerFile):
+        raise FilepickerException(
+            'Could not store {}: {}'.format(item_key(item), file))
+    return {'url': file.url, 'metadata': file.metadata}
+
+
+def download(client, item, options):
+    file = _file(client, item, options)
+    path = item.get('path') if isinstance(item, dict) else None
+    path = path or os.path.join(options.output_dir, file.handle)
+    response = file.download(path, verify=options.verify)
+    if response is not None and not response.ok and \
+            response.status_code != 304:
+        response.raise_for_status()
+    return {'path': path, 'size': os.path.getsize(path)}
+
+
+def delete(client, item, options):
+    file = _file(client, item, options)
+    response = file.delete()
+    if not isinstance(response, requests.Response):
+        raise FilepickerException(
+            'Could not delete {}: {}'.format(file.handle, response))
+    if response.status_code != 404:
+        response.raise_for_status()
+    return {'status_code': response.status_code}
+
+
+def metadata(client, item, options):
+    file = _file(client, item, options)
+    fields = options.fields.split(',') if options.fields else None
+    response = file.update_metadata(fields=fields)
+    if not response.ok:
+        raise FilepickerException(
+            'Could not fetch metadata for {}: {}'.format(file.handle,
+                                                         response))
+    return {'url': file.url, 'metadata': file.metadata}
+
+
+COMMANDS = {'upload': upload, 'download': download, 'delete': delete,
+            'metadata': metadata}
+
+
+def _init_worker(options):
+    global _client, _options
+    _client = make_client(options)
+    _options = options
+
+
+def _run_batch(batch):
+    command = COMMANDS[_options.command]
+    records = []
+    results = run_bulk(lambda entry: command(_client, entry[1], _options),
+                       batch, concurrency=_options.threads)
+    for result in results:
+        key, item = result.item
+        if result.error is None:
+            record = dict(result.result, item=item, ok=True)
+        else:
+            record = {'item': item, 'ok': False, 'error': '{}: {}'.format(
+                type(result.error).__name__, result.error)}
+        records.append((key, record))
+    return records
+
+
+def _batches(entries, size, semaphore, stop):
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= size:
+            semaphore.acquire()
+            if stop.is_set():
+                return
+            yield batch
+            batch = []
+    if batch:
+        semaphore.acquire()
+        if not stop.is_set():
+            yield batch
+
+
+def run(options, progress_callback=None):
+    results = Checkpoint(options.results)
+    done = set(key for key, record in results.done.items()
+               if record.get('ok'))
+    progress = BulkProgress()
+
+    def pending():
+        for item in read_manifest(options.manifest):
+            key = item_key(item)
+            if key in done:
+                progress.skipped += 1
+                continue
+            yield key, item
+
+    semaphore = threading.Semaphore(options.processes * 2)
+    stop = threading.Event()
+    batches = _batches(pending(), options.batch_size, semaphore, stop)
+    pool = None
+    if options.processes > 1:
+        pool = multiprocessing.Pool(options.processes, _init_worker,
+                                    (options,))
+        completed = pool.imap_unordered(_run_batch, batches)
+    else:
+        _init_worker(options)
+        completed = (_run_batch(batch) for batch in batches)
+
+    try:
+        for records in completed:
+            semaphore.release()
+            for key, record in records:
+                results.record(key, **record)
+                progress.update(record.get('error'))
+            if progress_callback is not None:
+                progress_callback(progress)
+    except BaseException:
+        stop.set()
+        semaphore.release()
+        if pool is not None:
+            pool.terminate()
+        raise
+    else:
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.join()
+        else:
+            _client.close()
+        results.close()
+    return progress
+
+
+def main(argv=None, out=sys.stderr):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('manifest',
+                        help='file with one path, url or handle per line, '
+                             'or JSON objects (JSONL); - reads stdin')
+    common.add_argument('--results',
+                        help='JSONL results file, also used to resume '
+                             '(default: MANIFEST.results.jsonl)')
+    common.add_argument('--api-key',
+                        default=os.environ.get('FILEPICKER_API_KEY'))
+    common.add_argument('--app-secret',
+                        default=os.environ.get('FILEPICKER_APP_SECRET'))
+    common.add_argument('--api-url',
+                        help='override the REST API base url, also used '
+                             'for bare handles in the manifest')
+    common.add_argument('--storage', default='S3')
+    common.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    common.add_argument('--threads', type=int, default=8,
+                        help='concurrent requests per process')
+    common.add_argument('--batch-size', type=int, default=32,
+                        help='items handed to a process at a time')
+
+    parser = argparse.ArgumentParser(
+        prog='filepicker',
+        description='Run bulk Filepicker operations from a manifest.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    commands.add_parser('upload', parents=[common],
+                        help='store local files or urls')
+    download_parser = commands.add_parser('download', parents=[common],
+                                          help='download files')
+    download_parser.add_argument('--output-dir', default='.')
+    download_parser.add_argument('--verify', action='store_true',
+                                 help='check downloads against their md5')
+    commands.add_parser('delete', parents=[common], help='delete files')
+    metadata_parser = commands.add_parser('metadata', parents=[common],
+                                          help='fetch file metadata')
+    metadata_parser.add_argument('--fields',
+                                 help='comma separated metadata fields')
+    options = parser.parse_args(argv)
+
+    if options.results is None:
+        if options.manifest == '-':
+            parser.error('--results is required when reading stdin')
+        options.results = options.manifest + '.results.jsonl'
+    options.processes = max(options.processes, 1)
+
+    progress = run(options)
+    out.write('{} completed, {} failed, {} skipped in {:.1f}s '
+              '({:.1f}/s)\n'.format(progress.completed, progress.failed,
+                                    progress.skipped, progress.elapsed,
+                                    progress.throughput))
+    return 1 if progress.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,22 +1,52 @@
-import mimetypes
 import json
 import os
 
 import requests
 
+from .filepicker_bulk import run_bulk, run_checkpointed
+from .filepicker_convert import Converter
+from .filepicker_dedup import HashingSource, dedup_key, hash_source
+from .filepicker_exceptions import FilepickerException
 from .filepicker_file import FilepickerFile
+from .filepicker_multipart import (BufferSource, FileSource,
+                                   MultipartEncoder, MultipartFileEncoder,
+                                   StreamSource, guess_mimetype)
+from .filepicker_pipeline import PipelineSource, UploadResult
 from .filepicker_policy import FilepickerPolicy
+from .filepicker_session import FilepickerSession
+from .filepicker_signer import URLSigner
 
 
 class FilepickerClient(object):
 
     API_URL = 'https://www.filepicker.io/api'
 
-    def __init__(self, api_key=None, storage='S3', app_secret=None):
+    def __init__(self, api_key=None, storage='S3', app_secret=None,
+                 session=None,
+                 pool_connections=FilepickerSession.DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=FilepickerSession.DEFAULT_POOL_MAXSIZE,
+                 pool_block=False, retry_policy=None, circuit_breaker=None,
+                 rate_limiter=None, concurrency_limiter=None,
+                 metadata_cache=None, lazy_metadata=False, converter=None,
+                 event_hooks=None, dedup_index=None, dedup_verify=False,
+                 content_cache=None):
         self.set_api_key(api_key)
         self.set_storage(storage)
         self.set_app_secret(app_secret)
         self.policies = {}
+        if session is None:
+            session = FilepickerSession(
+                pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                pool_block=pool_block, retry_policy=retry_policy,
+                circuit_breaker=circuit_breaker, rate_limiter=rate_limiter,
+                concurrency_limiter=concurrency_limiter,
+                event_hooks=event_hooks)
+        self.set_session(session)
+        self.set_metadata_cache(metadata_cache)
+        self.lazy_metadata = lazy_metadata
+        self.set_converter(converter)
+        self.set_dedup_index(dedup_index, verify=dedup_verify)
+        self.set_content_cache(content_cache)
 
     def set_api_key(self, api_key):
         self.api_key = api_key
@@ -27,6 +57,31 @@ class FilepickerClient(object):
     def set_app_secret(self, secret):
         self.app_secret = secret
 
+    def set_session(self, session):
+        self.session = session
+
+    def set_metadata_cache(self, metadata_cache):
+        self.metadata_cache = metadata_cache
+
+    def set_converter(self, converter):
+        self.converter = converter
+
+    def set_content_cache(self, content_cache):
+        self.content_cache = content_cache
+
+    def set_dedup_index(self, dedup_index, verify=False):
+        self.dedup_index = dedup_index
+        self.dedup_verify = verify
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def store_from_url(self, url, storage=None, policy_name=None, **kwargs):
         params = {}
         data = {'url': url}
@@ -37,33 +92,230 @@ class FilepickerClient(object):
         return self.__post(storage, data=data, params=params)
 
     def store_local_file(self, filepath, storage=None,
-                         policy_name=None, **kwargs):
-        filename = os.path.basename(filepath)
-        mimetype = mimetypes.guess_type(filepath)[0]
-        files = {'fileUpload': (filename, open(filepath, 'rb'), mimetype)}
+                         policy_name=None, progress_callback=None,
+                         use_mmap=False, dedup=None, **kwargs):
+        encoder = MultipartFileEncoder(filepath, use_mmap=use_mmap,
+                                       progress_callback=progress_callback)
+        return self.__store_encoded(encoder, storage, policy_name, kwargs,
+                                    dedup)
+
+    def store_bytes(self, data, storage=None, policy_name=None,
+                    filename_hint=None, mimetype=None,
+                    progress_callback=None, dedup=None, **kwargs):
+        encoder = MultipartEncoder(BufferSource(data), filename=filename_hint,
+                                   mimetype=mimetype,
+                                   progress_callback=progress_callback)
+        return self.__store_encoded(encoder, storage, policy_name, kwargs,
+                                    dedup)
+
+    def store_stream(self, stream, storage=None, policy_name=None,
+                     filename_hint=None, mimetype=None, size=None,
+                     progress_callback=None, dedup=None, **kwargs):
+        filename_hint = filename_hint or os.path.basename(
+            str(getattr(stream, 'name', '')))
+        encoder = MultipartEncoder(StreamSource(stream, size=size),
+                                   filename=filename_hint, mimetype=mimetype,
+                                   progress_callback=progress_callback)
+        return self.__store_encoded(encoder, storage, policy_name, kwargs,
+                                    dedup)
+
+    def store_pipelined(self, filepath, storage=None, policy_name=None,
+                        hash_names=('md5',), transform=None, queue_size=4,
+                        chunk_size=1024 * 1024, filename=None, mimetype=None,
+                        progress_callback=None, use_mmap=False, **kwargs):
+        source = PipelineSource(FileSource(filepath, use_mmap=use_mmap),
+                                hash_names=hash_names, transform=transform,
+                                queue_size=queue_size, chunk_size=chunk_size)
+        encoder = MultipartEncoder(
+            source, filename=filename or os.path.basename(filepath),
+            mimetype=mimetype or guess_mimetype(filename=filepath),
+            chunk_size=chunk_size, progress_callback=progress_callback)
+        file = self.__store_encoded(encoder, storage, policy_name, kwargs,
+                                    dedup=False)
+        size = source.pipeline.size if source.pipeline else 0
+        return UploadResult(file, size, source.digests)
+
+    def store_item(self, item, storage=None, policy_name=None, **kwargs):
+        if isinstance(item, dict):
+            options = dict(item)
+            url = options.pop('url', None)
+            filepath = options.pop('filepath', None)
+        elif os.path.isfile(item):
+            options, url, filepath = {}, None, item
+        else:
+            options, url, filepath = {}, item, None
+        options.setdefault('storage', storage)
+        options.setdefault('policy_name', policy_name)
+        for key, value in kwargs.items():
+            options.setdefault(key, value)
+        if filepath:
+            return self.store_local_file(filepath, **options)
+        if url:
+            return self.store_from_url(url, **options)
+        raise ValueError('Please provide url or filepath for {}'.format(item))
+
+    def store_many(self, items, storage=None, policy_name=None,
+                   concurrency=8, max_in_flight=None, **kwargs):
+        def store(item):
+            file = self.store_item(item, storage=storage,
+                                   policy_name=policy_name, **kwargs)
+            if not isinstance(file, FilepickerFile):
+                raise FilepickerException(
+                    'Could not store {}: {}'.format(item, file))
+            return file
+
+        return run_bulk(store, items, concurrency=concurrency,
+                        max_in_flight=max_in_flight)
+
+    def get_file(self, handle=None, url=None, response_dict=None):
+        return FilepickerFile(handle=handle, url=url,
+                              response_dict=response_dict,
+                              api_key=self.api_key,
+                              app_secret=self.app_secret,
+                              policies=self.policies,
+                              session=self.session,
+                              metadata_cache=self.metadata_cache,
+                              lazy=self.lazy_metadata,
+                              converter=self.converter,
+                              content_cache=self.content_cache)
+
+    def fetch_metadata_many(self, handles, fields=None, policy_name=None,
+                            concurrency=8, max_in_flight=None):
+        def fetch(handle):
+            if isinstance(handle, FilepickerFile):
+                file = handle
+            else:
+                file = self.get_file(handle=handle)
+            response = file.update_metadata(policy_name, fields=fields)
+            if not response.ok:
+                raise FilepickerException(
+                    'Could not fetch metadata for {}: {}'.format(
+                        file.handle, response))
+            return file
+
+        return run_bulk(fetch, handles, concurrency=concurrency,
+                        max_in_flight=max_in_flight)
+
+    def convert_many(self, handles, conversions, concurrency=8,
+                     max_in_flight=None):
+        converter = self.converter or Converter()
+        return converter.convert_many(self.__files(handles), conversions,
+                                      concurrency=concurrency,
+                                      max_in_flight=max_in_flight)
+
+    def migrate(self, handles, storage=None, path=None, policy_name=None,
+                source_policy=None, concurrency=8, max_in_flight=None,
+                checkpoint=None, progress_callback=None, **kwargs):
+        storage = storage or self.storage
+
+        def copy(file):
+            target = path(file) if callable(path) else path
+            copied = file.copy_to(storage, path=target,
+                                  policy_name=policy_name,
+                                  source_policy=source_policy, **kwargs)
+            if not isinstance(copied, FilepickerFile):
+                raise FilepickerException(
+                    'Could not copy {}: {}'.format(file.handle, copied))
+            return copied
+
+        return run_checkpointed(
+            copy, self.__files(handles), key=lambda file: file.handle,
+            checkpoint=checkpoint,
+            record=lambda result: {'url': result.result.url},
+            progress_callback=progress_callback, concurrency=concurrency,
+            max_in_flight=max_in_flight)
+
+    def delete_many(self, handles, policy_name=None, concurrency=8,
+                    max_in_flight=None, checkpoint=None,
+                    progress_callback=None):
+        def delete(file):
+            response = file.delete(policy_name)
+            if not isinstance(response, requests.Response):
+                raise FilepickerException(
+                    'Could not delete {}: {}'.format(file.handle, response))
+            if response.status_code != 404:
+                response.raise_for_status()
+            return response
+
+        return run_checkpointed(
+            delete, self.__files(handles), key=lambda file: file.handle,
+            checkpoint=checkpoint, progress_callback=progress_callback,
+            concurrency=concurrency, max_in_flight=max_in_flight)
+
+    def add_policy(self, name, policy):
+        if self.app_secret is None:
+            raise Exception("Please set app secret first")
+        self.policies[name] = FilepickerPolicy(policy, self.app_secret)
+
+    def url_signer(self, policy_name, **kwargs):
+        return URLSigner(self.policies[policy_name], **kwargs)
+
+    def __files(self, handles):
+        return (h if isinstance(h, FilepickerFile) else
+                self.get_file(handle=h) for h in handles)
+
+    def __store_encoded(self, encoder, storage, policy_name, kwargs,
+                        dedup=None):
         params = {}
         if policy_name:
             params.update(self.policies[policy_name].signature_params())
         if kwargs:
             params.update(kwargs)
-        return self.__post(storage, files=files, params=params)
 
-    def add_policy(self, name, policy):
-        if self.app_secret is None:
-            raise Exception("Please set app secret first")
-        self.policies[name] = FilepickerPolicy(policy, self.app_secret)
+        def post():
+            return self.__post(storage, data=encoder.body, params=params,
+                               headers=encoder.headers)
+
+        with encoder:
+            if dedup is False or (dedup is None and self.dedup_index is None):
+                return post()
+            if self.dedup_index is None:
+                raise Exception("Please set dedup index first")
+            return self.__store_deduplicated(encoder, post,
+                                             storage or self.storage, kwargs)
+
+    def __store_deduplicated(self, encoder, post, storage, options):
+        source = encoder.source
+        if source.rewind():
+            digest, size = hash_source(source)
+            source.rewind()
+            key = dedup_key(digest, size, storage, options)
+            existing = self.__find_duplicate(key, digest)
+            if existing is not None:
+                return existing
+            stored = post()
+        else:
+            hashing = encoder.source = HashingSource(source)
+            stored = post()
+            digest, size = hashing.md5.hexdigest(), hashing.read_size
+            key = dedup_key(digest, size, storage, options)
+        if isinstance(stored, FilepickerFile):
+            self.dedup_index.set(key, dict(stored.metadata or {},
+                                           url=stored.url, md5=digest))
+        return stored
+
+    def __find_duplicate(self, key, digest):
+        entry = self.dedup_index.get(key)
+        if entry is None:
+            return None
+        file = self.get_file(url=entry.pop('url'))
+        file.metadata = entry
+        if self.dedup_verify:
+            file.metadata.pop('md5', None)
+            file.update_metadata(fields=['md5'])
+            if file.metadata.get('md5') != digest:
+                self.dedup_index.delete(key)
+                return None
+        return file
 
-    def __post(self, storage, data=None, files=None, params=None):
+    def __post(self, storage, data=None, params=None, headers=None):
         storage = storage or self.storage
         post_url = '{}/store/{}'.format(self.API_URL, storage)
         params['key'] = self.api_key
-        response = requests.post(post_url, data=data, files=files,
-                                 params=params)
+        response = self.session.post(post_url, data=data, params=params,
+                                     headers=headers)
         try:
             response_dict = json.loads(response.text)
-            return FilepickerFile(response_dict=response_dict,
-                                  api_key=self.api_key,
-                                  app_secret=self.app_secret,
-                                  policies=self.policies)
+            return self.get_file(response_dict=response_dict)
         except ValueError:
             return response
@@ -0,0 +1,281 @@
+import errno
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from urllib.parse import urlsplit, parse_qsl
+except ImportError:
+    from urlparse import urlsplit, parse_qsl
+
+from .filepicker_convert import conversion_key
+from .filepicker_download import _replace, check_md5
+
+
+FICLONE = 0x40049409
+
+
+def content_key(file):
+    if not file.temporary:
+        return file.handle
+    url = urlsplit(file.url)
+    handle = re.search(r'file/(\w+)', url.path).group(1)
+    return '{}:{}'.format(url.path.rsplit('/', 1)[-1],
+                          conversion_key(handle, dict(parse_qsl(url.query))))
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _sendfile(src, dst, size):
+    if not hasattr(os, 'sendfile'):
+        return False
+    offset = 0
+    try:
+        while offset < size:
+            sent = os.sendfile(dst.fileno(), src.fileno(), offset,
+                               size - offset)
+            if not sent:
+                break
+            offset += sent
+    except OSError:
+        if offset:
+            raise
+        return False
+    return True
+
+
+class ContentCache(object):
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, directory, max_size=1024 ** 3, revalidate_after=None,
+                 hardlink=False, clock=time.time, event_hooks=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.revalidate_after = revalidate_after
+        self.hardlink = hardlink
+        self.clock = clock
+        self.event_hooks = event_hooks
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.size = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._scan()
+
+    def _scan(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith('.json') or name.startswith('.'):
+                    continue
+                path = os.path.join(root, name[:-5])
+                try:
+                    size = os.path.getsize(path)
+                    used = os.path.getmtime(path + '.json')
+                except OSError:
+                    continue
+                self._entries[path] = [size, used]
+                self.size += size
+
+    def path(self, key):
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name[:2], name)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'revalidated': self.revalidated,
+                'evictions': self.evictions, 'size': self.size,
+                'entries': len(self._entries)}
+
+    def download(self, file, url, destination_path,
+                 chunk_size=CHUNK_SIZE):
+        key = content_key(file)
+        path = self.path(key)
+        entry = self._load(path)
+        expected_md5 = (file.metadata or {}).get('md5')
+        if entry is not None and expected_md5 and \
+                entry.get('md5') != expected_md5:
+            self._evict(path)
+            entry = None
+        self._count('hits' if entry is not None else 'misses', key)
+
+        response = None
+        if entry is None:
+            response = file.session.get(url, stream=True)
+            if not response.ok:
+                return response
+            self._store(key, path, response, chunk_size, expected_md5)
+        elif (self.revalidate_after is not None and
+              self.clock() - entry['validated'] >= self.revalidate_after):
+            response = self._revalidate(key, path, entry, file.session, url,
+                                        chunk_size, expected_md5)
+            if not response.ok and response.status_code != 304:
+                return response
+        self._touch(path)
+        self._deliver(path, destination_path)
+        return response
+
+    def invalidate(self, file):
+        self._evict(self.path(content_key(file)))
+
+    def _revalidate(self, key, path, entry, session, url, chunk_size,
+                    expected_md5):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        response = session.get(url, stream=True, headers=headers)
+        with self._lock:
+            self.revalidated += 1
+        if response.status_code == 304:
+            response.close()
+            entry['validated'] = self.clock()
+            self._write_json(path + '.json', entry)
+        elif response.ok:
+            self._store(key, path, response, chunk_size, expected_md5)
+        else:
+            response.close()
+            if response.status_code in (404, 410):
+                self._evict(path)
+        return response
+
+    def _store(self, key, path, response, chunk_size, expected_md5=None):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+        md5 = hashlib.md5()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+                    md5.update(chunk)
+                    size += len(chunk)
+            if expected_md5:
+                check_md5(md5.hexdigest(), expected_md5, response.url)
+            _replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        finally:
+            response.close()
+        self._write_json(path + '.json', {
+            'key': key, 'size': size, 'md5': md5.hexdigest(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'validated': self.clock()})
+        with self._lock:
+            previous = self._entries.get(path)
+            if previous is not None:
+                self.size -= previous[0]
+            self._entries[path] = [size, self.clock()]
+            self.size += size
+        self._evict_over_limit(keep=path)
+
+    def _write_json(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-',
+                                        dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        _replace(tmp_path, path)
+
+    def _load(self, path):
+        try:
+            with open(path + '.json') as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if not os.path.exists(path):
+            return None
+        return entry
+
+    def _touch(self, path):
+        now = self.clock()
+        with self._lock:
+            if path in self._entries:
+                self._entries[path][1] = now
+        try:
+            os.utime(path + '.json', (now, now))
+        except OSError:
+            pass
+
+    def _count(self, name, key):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+        if self.event_hooks is not None:
+            self.event_hooks.emit(
+                'cache_hit' if name == 'hits' else 'cache_miss',
+                cache=type(self).__name__, key=key)
+
+    def _deliver(self, path, destination_path):
+        if self.hardlink:
+            tmp_path = destination_path + '.fplink'
+            try:
+                os.link(path, tmp_path)
+                _replace(tmp_path, destination_path)
+                return
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        with open(path, 'rb') as src:
+            with open(destination_path, 'wb') as dst:
+                if _reflink(src, dst):
+                    return
+                size = os.fstat(src.fileno()).st_size
+                if not _sendfile(src, dst, size):
+                    shutil.copyfileobj(src, dst, self.CHUNK_SIZE)
+
+    def _evict(self, path):
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self.size -= entry[0]
+                self.evictions += 1
+        for name in (path + '.json', path):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+    def _evict_over_limit(self, keep=None):
+        with self._lock:
+            if self.size <= self.max_size:
+                return
+            victims = sorted(self._entries.items(), key=lambda e: e[1][1])
+        for path, _ in victims:
+            if self.size <= self.max_size:
+                return
+            if path != keep:
+                self._evict(path)
+
+    def clear(self):
+        for path in list(self._entries):
+            self._evict(path)
@@ -0,0 +1,110 @@
+import threading
+
+from .filepicker_bulk import run_bulk
+from .filepicker_cache import LRUMetadataCache
+
+
+def conversion_key(handle, params):
+    return (handle, tuple(sorted(
+        (k, str(v)) for k, v in params.items()
+        if k not in Converter.IGNORED_PARAMS)))
+
+
+class SingleFlight(object):
+
+    class _Call(object):
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                self.shared += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class ConversionCache(LRUMetadataCache):
+
+    def __init__(self, max_size=10000, ttl=None, **kwargs):
+        super(ConversionCache, self).__init__(max_size=max_size, ttl=ttl,
+                                              **kwargs)
+
+
+class Converter(object):
+
+    IGNORED_PARAMS = ('signature', 'policy', 'key')
+
+    def __init__(self, cache=None):
+        self.cache = cache if cache is not None else ConversionCache()
+        self._flight = SingleFlight()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self, handle):
+        with self._lock:
+            self._generations[handle] = self._generations.get(handle, 0) + 1
+
+    def convert(self, file, policy_name=None, **params):
+        if file.temporary or not file.is_stored_conversion(params):
+            return file._convert(policy_name, **params)
+
+        policy = (file.policies[policy_name].signature_params()['policy']
+                  if policy_name else None)
+        key = (conversion_key(file.handle, params), policy, file.api_key,
+               self._generations.get(file.handle, 0))
+
+        def run():
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+            result = file._convert(policy_name, **params)
+            if not hasattr(result, 'url'):
+                return result
+            entry = {'url': result.url, 'metadata': result.metadata}
+            self.cache.set(key, entry)
+            return entry
+
+        entry = self._flight.do(key, run)
+        if not isinstance(entry, dict):
+            return entry
+        converted = file._derive(url=entry['url'])
+        converted.metadata = dict(entry['metadata'] or {})
+        return converted
+
+    def convert_many(self, files, conversions, concurrency=8,
+                     max_in_flight=None):
+        def convert(item):
+            file, name = item
+            params = dict(conversions[name])
+            policy_name = params.pop('policy_name', None)
+            return self.convert(file, policy_name, **params)
+
+        items = ((file, name) for file in files for name in conversions)
+        return run_bulk(convert, items, concurrency=concurrency,
+                        max_in_flight=max_in_flight)
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+try:
+    import urllib.parse as parser
+except ImportError:
+    import urllib as parser
+
+from .filepicker_cache import LRUMetadataCache, MetadataCache
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def dedup_key(digest, size, storage, options=None):
+    key = '{}:{}:{}'.format(storage, size, digest)
+    if options:
+        key += '?' + parser.urlencode(sorted(
+            (k, str(v)) for k, v in options.items()))
+    return key
+
+
+def hash_source(source, chunk_size=HASH_CHUNK_SIZE):
+    md5 = hashlib.md5()
+    size = 0
+    while True:
+        chunk = source.read(chunk_size)
+        if not len(chunk):
+            return md5.hexdigest(), size
+        md5.update(chunk)
+        size += len(chunk)
+
+
+class HashingSource(object):
+
+    def __init__(self, source):
+        self.source = source
+        self.size = source.size
+        self.md5 = hashlib.md5()
+        self.read_size = 0
+
+    def head(self):
+        return self.source.head() if hasattr(self.source, 'head') else None
+
+    def read(self, size):
+        chunk = self.source.read(size)
+        self.md5.update(chunk)
+        self.read_size += len(chunk)
+        return chunk
+
+    def rewind(self):
+        if not self.source.rewind():
+            return False
+        self.md5 = hashlib.md5()
+        self.read_size = 0
+        return True
+
+    def close(self):
+        self.source.close()
+
+
+class MemoryDedupIndex(LRUMetadataCache):
+
+    def __init__(self, max_size=100000, ttl=None, **kwargs):
+        super(MemoryDedupIndex, self).__init__(max_size=max_size, ttl=ttl,
+                                               **kwargs)
+
+
+class SQLiteDedupIndex(MetadataCache):
+
+    def __init__(self, path, max_size=None, ttl=None, clock=time.time,
+                 event_hooks=None):
+        super(SQLiteDedupIndex, self).__init__(event_hooks=event_hooks)
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS dedup_index ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'stored REAL NOT NULL, used REAL NOT NULL)')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS dedup_index_used '
+                'ON dedup_index (used)')
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM dedup_index').fetchone()[0]
+
+    def _get(self, key):
+        now = self.clock()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT value, stored FROM dedup_index WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and row[1] + self.ttl < now:
+                self._conn.execute('DELETE FROM dedup_index WHERE key = ?',
+                                   (key,))
+                return None
+            self._conn.execute('UPDATE dedup_index SET used = ? '
+                               'WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def _set(self, key, value):
+        now = self.clock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO dedup_index VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now, now))
+            if self.max_size is not None:
+                self._conn.execute(
+                    'DELETE FROM dedup_index WHERE key IN ('
+                    'SELECT key FROM dedup_index ORDER BY used DESC '
+                    'LIMIT -1 OFFSET ?)', (self.max_size,))
+
+    def _delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM dedup_index WHERE key = ?',
+                               (key,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM dedup_index')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self):
+        stats = super(SQLiteDedupIndex, self).stats()
+        stats['size'] = len(self)
+        return stats
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import namedtuple
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .filepicker_exceptions import ChecksumMismatch, FilepickerException
+
+
+DownloadResult = namedtuple('DownloadResult', ['response', 'size', 'digests'])
+
+
+def new_hashers(hash_names):
+    return dict((name, hashlib.new(name)) for name in hash_names or ())
+
+
+def hexdigests(hashers):
+    return dict((name, h.hexdigest()) for name, h in hashers.items())
+
+
+def file_md5(path, chunk_size):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def check_md5(actual_md5, expected_md5, path):
+    if actual_md5 != expected_md5:
+        raise ChecksumMismatch('Expected md5 {}, got {} for {}'.format(
+            expected_md5, actual_md5, path))
+
+
+_seek_lock = threading.Lock()
+
+
+def _pwrite(fd, data, offset):
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data, offset = data[written:], offset + written
+    else:
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            while data:
+                data = data[os.write(fd, data):]
+
+
+def _replace(src, dst):
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class RangedDownload(object):
+
+    STATE_SUFFIX = '.fpdownload'
+    CONTENT_RANGE_RE = re.compile(r'bytes \d+-\d+/(\d+)')
+
+    def __init__(self, session, url, destination_path, source=None,
+                 segments=4, chunk_size=1024 * 1024):
+        self.session = session
+        self.url = url
+        self.source = source or url
+        self.destination_path = destination_path
+        self.state_path = destination_path + self.STATE_SUFFIX
+        self.segments = max(1, segments)
+        self.chunk_size = chunk_size
+        self.size = None
+        self.state = None
+        self._lock = threading.Lock()
+
+    def run(self):
+        self.state = self._load_state()
+        response = None
+        if self.state is None:
+            response = self.session.get(self.url, stream=True,
+                                        headers={'Range': 'bytes=0-0'})
+            match = self.CONTENT_RANGE_RE.match(
+                response.headers.get('Content-Range', ''))
+            if response.status_code != 206 or not match:
+                self._write_whole(response)
+                return response
+            response.close()
+            self.state = self._new_state(int(match.group(1)))
+            self._save_state()
+
+        self.size = self.state['size']
+        fd = self._open_destination()
+        try:
+            pending = [s for s in self.state['segments'] if s[2] < s[1] - s[0]]
+            if pending:
+                with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+                    for result in pool.map(
+                            lambda s: self._fetch_segment(fd, s), pending):
+                        response = result
+        finally:
+            os.close(fd)
+        os.remove(self.state_path)
+        return response
+
+    def _new_state(self, size):
+        step = max(self.chunk_size, -(-size // self.segments))
+        segments = [[start, min(start + step, size), 0]
+                    for start in range(0, size, step)]
+        return {'source': self.source, 'size': size, 'segments': segments}
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return None
+        if not os.path.exists(self.destination_path):
+            return None
+        with open(self.state_path) as f:
+            try:
+                state = json.load(f)
+            except ValueError:
+                return None
+        if state.get('source') != self.source:
+            return None
+        return state
+
+    def _save_state(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        _replace(tmp_path, self.state_path)
+
+    def _open_destination(self):
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        fd = os.open(self.destination_path, flags, 0o644)
+        if os.fstat(fd).st_size != self.size:
+            os.ftruncate(fd, self.size)
+            if hasattr(os, 'posix_fallocate') and self.size:
+                try:
+                    os.posix_fallocate(fd, 0, self.size)
+                except OSError:
+                    pass
+        return fd
+
+    def _fetch_segment(self, fd, segment):
+        start, end, done = segment
+        headers = {'Range': 'bytes={}-{}'.format(start + done, end - 1)}
+        response = self.session.get(self.url, stream=True, headers=headers)
+        if response.status_code != 206:
+            response.close()
+            raise FilepickerException(
+                'Range request failed with status {}'.format(
+                    response.status_code))
+        for chunk in response.iter_content(self.chunk_size):
+            _pwrite(fd, chunk, start + segment[2])
+            with self._lock:
+                segment[2] += len(chunk)
+                self._save_state()
+        if segment[2] != end - start:
+            raise FilepickerException('Incomplete segment {}-{}'.format(
+                start, end))
+        return response
+
+    def _write_whole(self, response):
+        with open(self.destination_path, 'wb') as f:
+            if response.ok:
+                for chunk in response.iter_content(self.chunk_size):
+                    f.write(chunk)
@@ -0,0 +1,6 @@
+class FilepickerException(Exception):
+    pass
+
+
+class ChecksumMismatch(FilepickerException):
+    pass
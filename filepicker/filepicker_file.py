@@ -1,7 +1,6 @@
-import mimetypes
+import hashlib
 import json
 import re
-import os
 
 try:
     import urllib.parse as parser
@@ -10,22 +9,44 @@ except ImportError:
 
 import requests
 
+from .filepicker_download import (DownloadResult, RangedDownload, check_md5,
+                                  file_md5, hexdigests, new_hashers)
+from .filepicker_exceptions import FilepickerException
+from .filepicker_multipart import (BufferSource, MultipartEncoder,
+                                   MultipartFileEncoder, StreamSource)
+from .filepicker_pipeline import ChunkPipeline
 from .filepicker_policy import FilepickerPolicy
+from .filepicker_session import get_default_session
 
 
 class FilepickerFile(object):
 
+    __slots__ = ('url', 'handle', 'metadata', 'temporary', 'lazy',
+                 'lazy_policy', 'policies', 'session', 'api_key',
+                 'app_secret', 'metadata_cache', 'converter',
+                 'content_cache', '_fetched_fields',
+                 '__weakref__')
+
     FILE_API_URL = 'https://www.filepicker.io/api/file/'
+    STORE_API_URL = 'https://www.filepicker.io/api/store/'
+    DOWNLOAD_CHUNK_SIZE = 1024 * 1024
     METADATA_ATTRS = ['size', 'mimetype', 'filename', 'width',
                       'height', 'uploaded', 'writeable', 'md5',
                       'location', 'path', 'container', 'key']
+    STORING_OPTIONS = ['filename', 'storeLocation', 'storePath',
+                       'storeContainer', 'storeAccess']
 
     def __init__(self, handle=None, url=None, response_dict=None,
-                 api_key=None, app_secret=None, policies={},
+                 api_key=None, app_secret=None, policies=None,
+                 session=None, metadata_cache=None, lazy=False,
+                 lazy_policy=None, converter=None, content_cache=None,
                  **kwargs):
 
         self.metadata = None
         self.temporary = kwargs.get('temporary', False)
+        self.lazy = lazy
+        self.lazy_policy = lazy_policy
+        self._fetched_fields = set()
 
         if handle:
             self.__init_with_handle_or_url(handle=handle)
@@ -36,10 +57,20 @@ class FilepickerFile(object):
         else:
             raise AttributeError('Please provide file handle or url')
 
-        self.policies = policies
+        self.policies = policies if policies is not None else {}
+        self.set_session(session)
         self.handle = handle or self.__get_handle()
         self.set_api_key(api_key)
         self.set_app_secret(app_secret)
+        self.set_metadata_cache(metadata_cache)
+        self.set_converter(converter)
+        self.set_content_cache(content_cache)
+        if self.metadata_cache is not None and not self.temporary:
+            if self.metadata:
+                self.metadata_cache.set(self.handle, self.metadata)
+            else:
+                self.metadata = (self.metadata_cache.get(self.handle) or
+                                 self.metadata)
 
     def __init_with_dict(self, d):
         self.url = d['url']
@@ -66,15 +97,68 @@ class FilepickerFile(object):
     def set_app_secret(self, secret):
         self.app_secret = secret
 
-    def update_metadata(self, policy_name=None):
-        params = dict((x, 'true') for x in self.METADATA_ATTRS)
+    def set_session(self, session):
+        self.session = session or get_default_session()
+
+    def set_metadata_cache(self, metadata_cache):
+        self.metadata_cache = metadata_cache
+
+    def set_converter(self, converter):
+        self.converter = converter
+
+    def set_content_cache(self, content_cache):
+        self.content_cache = content_cache
+
+    def _cache_metadata(self):
+        if self.metadata_cache is not None and not self.temporary:
+            self.metadata_cache.set(self.handle, self.metadata)
+
+    def _invalidate_caches(self):
+        if self.metadata_cache is not None:
+            self.metadata_cache.delete(self.handle)
+        if self.converter is not None:
+            self.converter.invalidate(self.handle)
+        if self.content_cache is not None:
+            self.content_cache.invalidate(self)
+        self.metadata = {}
+        self._fetched_fields.clear()
+
+    def update_metadata(self, policy_name=None, fields=None):
+        params = self._metadata_params(policy_name, fields)
+        response = self.session.get(self.url + '/metadata',
+                                    params=params)
+        if response.ok:
+            self._apply_metadata(response.text, fields)
+        return response
+
+    def _metadata_params(self, policy_name=None, fields=None):
+        params = dict((x, 'true') for x in fields or self.METADATA_ATTRS)
         if policy_name:
             params.update(self.policies[policy_name].signature_params())
-        response = requests.get(self.url + '/metadata', params=params)
+        return params
+
+    def _apply_metadata(self, text, fields=None):
         try:
-            self.metadata = json.loads(response.text)
+            metadata = json.loads(text)
         except ValueError:
-            self.metadata = {}
+            return False
+        self._fetched_fields.update(fields or self.METADATA_ATTRS)
+        if fields:
+            metadata = dict(self.metadata or {}, **metadata)
+        self.metadata = metadata
+        self._cache_metadata()
+        return True
+
+    def _fetch_lazy(self, name):
+        fields = [name]
+        if self.lazy is not True:
+            fields.extend(f for f in self.lazy if f != name and
+                          f not in self.metadata and
+                          f not in self._fetched_fields)
+        response = self.update_metadata(self.lazy_policy, fields=fields)
+        if name not in self._fetched_fields:
+            raise FilepickerException('Could not fetch {} of {}: {}'.format(
+                name, self.handle, response))
 
     def delete(self, policy_name=None):
         if self.api_key is None:
@@ -82,51 +166,199 @@ class FilepickerFile(object):
         params = {'key': self.api_key}
         if policy_name:
             params.update(self.policies[policy_name].signature_params())
-        return requests.delete(self.url, params=params)
+        self._invalidate_caches()
+        return self.session.delete(self.url, params=params)
 
-    def download(self, destination_path, policy_name=None):
+    def download(self, destination_path, policy_name=None, segments=1,
+                 resume=False, chunk_size=DOWNLOAD_CHUNK_SIZE, verify=False):
         url = self.get_signed_url(policy_name) if policy_name else self.url
-        with open(destination_path, 'wb') as f:
-            response = requests.get(url, stream=True)
-            if response.ok:
-                for chunk in response.iter_content(1024):
-                    if not chunk:
-                        break
+        md5 = None
+        if self.content_cache is not None and segments <= 1 and not resume:
+            response = self.content_cache.download(self, url,
+                                                   destination_path,
+                                                   chunk_size)
+        elif segments > 1 or resume:
+            response = RangedDownload(self.session, url, destination_path,
+                                      source=self.url, segments=segments,
+                                      chunk_size=chunk_size).run()
+        else:
+            md5 = hashlib.md5() if verify else None
+            with open(destination_path, 'wb') as f:
+                response = self.session.get(url, stream=True)
+                if response.ok:
+                    for chunk in response.iter_content(chunk_size):
+                        f.write(chunk)
+                        if md5:
+                            md5.update(chunk)
+        if verify and (response is None or response.ok):
+            if not self.md5:
+                self.update_metadata(policy_name)
+            actual = (md5.hexdigest() if md5 else
+                      file_md5(destination_path, chunk_size))
+            check_md5(actual, self.md5, destination_path)
+        return response
+
+    def iter_bytes(self, chunk_size=DOWNLOAD_CHUNK_SIZE, policy_name=None,
+                   hashers=None):
+        response = self.__open_stream(policy_name)
+        hashers = list((hashers or {}).values())
+        try:
+            for chunk in response.iter_content(chunk_size):
+                for h in hashers:
+                    h.update(chunk)
+                yield chunk
+        finally:
+            response.close()
+
+    def download_to(self, fileobj, policy_name=None,
+                    chunk_size=DOWNLOAD_CHUNK_SIZE, hash_names=('md5',)):
+        hashers = new_hashers(hash_names)
+        response = self.__open_stream(policy_name)
+        size = 0
+        try:
+            for chunk in response.iter_content(chunk_size):
+                fileobj.write(chunk)
+                size += len(chunk)
+                for h in hashers.values():
+                    h.update(chunk)
+        finally:
+            response.close()
+        return DownloadResult(response, size, hexdigests(hashers))
+
+    def read_into(self, buffer, offset=0, policy_name=None,
+                  hash_names=('md5',)):
+        hashers = new_hashers(hash_names)
+        view = memoryview(buffer)
+        if view.ndim != 1 or view.itemsize != 1:
+            if not hasattr(view, 'cast'):
+                raise FilepickerException(
+                    'Please pass a byte buffer to read_into')
+            view = view.cast('B')
+        response = self.__open_stream(policy_name)
+        response.raw.decode_content = True
+        pos = offset
+        try:
+            while True:
+                if pos == len(view):
+                    if response.raw.read(1):
+                        raise FilepickerException(
+                            'Buffer too small for {}'.format(self.url))
+                    break
+                read = response.raw.readinto(view[pos:])
+                if not read:
+                    break
+                for h in hashers.values():
+                    h.update(view[pos:pos + read])
+                pos += read
+        finally:
+            response.close()
+        return DownloadResult(response, pos - offset, hexdigests(hashers))
+
+    def download_pipelined(self, destination_path, policy_name=None,
+                           hash_names=('md5',), transform=None, queue_size=4,
+                           chunk_size=DOWNLOAD_CHUNK_SIZE, verify=False):
+        if verify and 'md5' not in hash_names:
+            hash_names = tuple(hash_names) + ('md5',)
+        response = self.__open_stream(policy_name)
+        pipeline = ChunkPipeline(response.iter_content(chunk_size),
+                                 hash_names=hash_names, transform=transform,
+                                 queue_size=queue_size)
+        try:
+            with open(destination_path, 'wb') as f:
+                for chunk in pipeline:
                     f.write(chunk)
-            return response
+        finally:
+            pipeline.close()
+            response.close()
+        digests = pipeline.digests
+        if verify:
+            if not self.md5:
+                self.update_metadata(policy_name)
+            check_md5(digests['md5'], self.md5, destination_path)
+        return DownloadResult(response, pipeline.size, digests)
 
-    def overwrite(self, url=None, filepath=None, policy_name=None):
-        data, files, params = None, None, None
-        if url:
-            data = {'url': url}
+    def __open_stream(self, policy_name=None):
+        url = self.get_signed_url(policy_name) if policy_name else self.url
+        response = self.session.get(url, stream=True)
+        response.raise_for_status()
+        return response
+
+    def overwrite(self, url=None, filepath=None, policy_name=None,
+                  progress_callback=None, use_mmap=False, data=None,
+                  stream=None, filename_hint=None, mimetype=None, size=None):
+        params = {}
+        if policy_name:
+            params.update(self.policies[policy_name].signature_params())
+        self._invalidate_caches()
         if filepath:
-            filename = os.path.basename(filepath)
-            mimetype = mimetypes.guess_type(filepath)[0]
-            files = {'fileUpload': (filename, open(filepath, 'rb'), mimetype)}
+            encoder = MultipartFileEncoder(
+                filepath, use_mmap=use_mmap,
+                progress_callback=progress_callback)
+        elif data is not None:
+            encoder = MultipartEncoder(
+                BufferSource(data), filename=filename_hint,
+                mimetype=mimetype, progress_callback=progress_callback)
+        elif stream is not None:
+            encoder = MultipartEncoder(
+                StreamSource(stream, size=size), filename=filename_hint,
+                mimetype=mimetype, progress_callback=progress_callback)
+        else:
+            return self.__post(self.url, data={'url': url}, params=params)
+        with encoder:
+            return self.__post(self.url, data=encoder.body, params=params,
+                               headers=encoder.headers)
+
+    def copy_to(self, storage='S3', path=None, policy_name=None,
+                source_policy=None, **kwargs):
+        if self.api_key is None:
+            return "Please set API key first"
+        source = (self.get_signed_url(source_policy) if source_policy
+                  else self.url)
+        params = {'key': self.api_key}
+        if path:
+            params['path'] = path
         if policy_name:
             params.update(self.policies[policy_name].signature_params())
-        return self.__post(self.url, data=data, files=files, params=params)
+        params.update(kwargs)
+        return self.__post(self.STORE_API_URL + storage,
+                           data={'url': source}, params=params)
 
     def convert(self, policy_name=None, **kwargs):
+        if self.converter is not None:
+            return self.converter.convert(self, policy_name, **kwargs)
+        return self._convert(policy_name, **kwargs)
+
+    def is_stored_conversion(self, params):
+        return bool(set(self.STORING_OPTIONS) & set(params.keys()))
+
+    def _convert(self, policy_name=None, **kwargs):
         if self.temporary:
             return "File already converted"
 
-        storing_options = ['filename', 'storeLocation', 'storePath',
-                           'storeContainer', 'storeAccess']
         if policy_name:
             kwargs.update(self.policies[policy_name].signature_params())
 
-        if set(storing_options) & set(kwargs.keys()):
+        if self.is_stored_conversion(kwargs):
             if self.api_key is None:
                 return "Please set API key first"
             kwargs['key'] = self.api_key
             return self.__post(self.url + '/convert', params=kwargs)
 
         url = '{}/convert?{}'.format(self.url, parser.urlencode(kwargs))
-        return FilepickerFile(url=url, api_key=self.api_key,
+        return self._derive(url=url, temporary=True)
+
+    def _derive(self, url=None, response_dict=None, temporary=False):
+        return FilepickerFile(url=url, response_dict=response_dict,
+                              api_key=self.api_key,
                               app_secret=self.app_secret,
                               policies=self.policies,
-                              temporary=True)
+                              session=self.session,
+                              metadata_cache=self.metadata_cache,
+                              lazy=self.lazy and not temporary,
+                              lazy_policy=self.lazy_policy,
+                              converter=self.converter,
+                              content_cache=self.content_cache,
+                              temporary=temporary)
 
     def add_policy(self, name, policy):
         if self.app_secret is None:
@@ -137,22 +369,39 @@ class FilepickerFile(object):
         params = self.policies[policy_name].signature_params()
         return self.url + '?' + parser.urlencode(params)
 
-    def __post(self, url, data=None, files=None, **kwargs):
+    def __post(self, url, data=None, **kwargs):
         try:
-            r = requests.post(url, data=data, files=files,
-                              params=kwargs.get('params'))
+            r = self.session.post(url, data=data,
+                                  params=kwargs.get('params'),
+                                  headers=kwargs.get('headers'))
             rd = json.loads(r.text)
-            return FilepickerFile(
-                    response_dict=rd, api_key=self.api_key,
-                    app_secret=self.app_secret,
-                    policies=self.policies)
+            return self._derive(response_dict=rd)
         except requests.exceptions.ConnectionError as e:
             raise e
 
-    def __getattribute__(self, name):
-        attrs = super(FilepickerFile, self).__getattribute__('METADATA_ATTRS')
-        if name in attrs:
-            return super(FilepickerFile, self) \
-                      .__getattribute__('metadata').get(name)
-        else:
-            return super(FilepickerFile, self).__getattribute__(name)
+
+class MetadataAttribute(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        metadata = instance.metadata
+        if metadata is None:
+            return None
+        if (instance.lazy and self.name not in metadata and
+                self.name not in instance._fetched_fields):
+            instance._fetch_lazy(self.name)
+            metadata = instance.metadata
+        return metadata.get(self.name)
+
+    def __set__(self, instance, value):
+        if instance.metadata is None:
+            instance.metadata = {}
+        instance.metadata[self.name] = value
+
+
+for _name in FilepickerFile.METADATA_ATTRS:
+    setattr(FilepickerFile, _name, MetadataAttribute(_name))
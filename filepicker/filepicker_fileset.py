@@ -0,0 +1,253 @@
+import math
+import re
+from array import array
+
+from .filepicker_file import FilepickerFile
+
+try:
+    array('q')
+    OFFSET_TYPECODE, INTEGER_TYPECODE = 'Q', 'q'
+except ValueError:
+    OFFSET_TYPECODE, INTEGER_TYPECODE = 'L', 'l'
+
+
+class StringColumn(object):
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array(OFFSET_TYPECODE, [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+    def append(self, value):
+        self.data.extend((value or '').encode('utf-8'))
+        self.offsets.append(len(self.data))
+
+    def take(self, indices):
+        column = StringColumn()
+        for i in indices:
+            column.data.extend(self.data[self.offsets[i]:self.offsets[i + 1]])
+            column.offsets.append(len(column.data))
+        return column
+
+
+class CategoryColumn(object):
+
+    def __init__(self, values=None):
+        self.values = list(values or [None])
+        self.index = dict((v, i) for i, v in enumerate(self.values))
+        self.codes = array('I')
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+    def append(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def take(self, indices):
+        column = CategoryColumn(self.values)
+        codes = self.codes
+        column.codes = array('I', (codes[i] for i in indices))
+        return column
+
+
+class NumericColumn(object):
+
+    def __init__(self, typecode, missing):
+        self.typecode = typecode
+        self.missing = missing
+        self.values = array(typecode)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        value = self.values[i]
+        return None if self._is_missing(value) else value
+
+    def _is_missing(self, value):
+        if self.typecode == 'd':
+            return math.isnan(value)
+        return value == self.missing
+
+    def append(self, value):
+        self.values.append(self.missing if value is None else value)
+
+    def take(self, indices):
+        column = NumericColumn(self.typecode, self.missing)
+        values = self.values
+        column.values = array(self.typecode, (values[i] for i in indices))
+        return column
+
+    def present(self):
+        return [v for v in self.values if not self._is_missing(v)]
+
+
+class FileSet(object):
+
+    FIELDS = ('handle', 'base_url', 'filename', 'mimetype', 'size',
+              'width', 'height', 'uploaded')
+    NUMERIC_FIELDS = ('size', 'width', 'height', 'uploaded')
+
+    def __init__(self, client=None):
+        self.client = client
+        self.columns = {
+            'handle': StringColumn(),
+            'base_url': CategoryColumn(),
+            'filename': StringColumn(),
+            'mimetype': CategoryColumn(),
+            'size': NumericColumn(INTEGER_TYPECODE, -1),
+            'width': NumericColumn('l', -1),
+            'height': NumericColumn('l', -1),
+            'uploaded': NumericColumn('d', float('nan')),
+        }
+
+    @classmethod
+    def from_responses(cls, response_dicts, client=None):
+        fileset = cls(client)
+        for response_dict in response_dicts:
+            fileset.append(url=response_dict['url'], metadata=response_dict)
+        return fileset
+
+    @classmethod
+    def from_files(cls, files, client=None):
+        fileset = cls(client)
+        fileset.extend(files)
+        return fileset
+
+    def __len__(self):
+        return len(self.columns['handle'])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.file(i)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.take(range(*i.indices(len(self))))
+        return self.file(i)
+
+    def append(self, handle=None, url=None, metadata=None):
+        if url is None:
+            url = FilepickerFile.FILE_API_URL + handle
+        match = re.search(r'file/(\w+)', url)
+        if match is None:
+            raise Exception("Invalid file url")
+        handle = handle or match.group(1)
+        metadata = metadata or {}
+        columns = self.columns
+        columns['handle'].append(handle)
+        columns['base_url'].append(url[:match.start(1)])
+        columns['filename'].append(metadata.get('filename'))
+        columns['mimetype'].append(metadata.get('mimetype') or
+                                   metadata.get('type'))
+        for name in self.NUMERIC_FIELDS:
+            columns[name].append(metadata.get(name))
+
+    def add(self, file):
+        self.append(handle=file.handle, url=file.url, metadata=file.metadata)
+
+    def extend(self, files):
+        for file in files:
+            if isinstance(file, dict):
+                self.append(url=file['url'], metadata=file)
+            else:
+                self.add(file)
+
+    def column(self, name):
+        column = self.columns[name]
+        return [column[i] for i in range(len(column))]
+
+    def handles(self):
+        column = self.columns['handle']
+        return (column[i] for i in range(len(column)))
+
+    def row(self, i):
+        row = dict((name, self.columns[name][i]) for name in self.FIELDS)
+        row['filename'] = row['filename'] or None
+        return row
+
+    def url(self, i):
+        return self.columns['base_url'][i] + self.columns['handle'][i]
+
+    def file(self, i):
+        row = self.row(i)
+        url = row.pop('base_url') + row.pop('handle')
+        if self.client is not None:
+            file = self.client.get_file(url=url)
+        else:
+            file = FilepickerFile(url=url)
+        file.metadata = dict((k, v) for k, v in row.items()
+                             if v is not None)
+        return file
+
+    def take(self, indices):
+        fileset = FileSet(self.client)
+        indices = list(indices)
+        fileset.columns = dict((name, column.take(indices))
+                               for name, column in self.columns.items())
+        return fileset
+
+    def indices(self, **conditions):
+        matches = range(len(self))
+        for name, condition in conditions.items():
+            column = self.columns[name]
+            if callable(condition):
+                matches = [i for i in matches if condition(column[i])]
+            elif isinstance(column, CategoryColumn):
+                code = column.index.get(condition)
+                codes = column.codes
+                matches = [i for i in matches if codes[i] == code]
+            else:
+                matches = [i for i in matches if column[i] == condition]
+        return list(matches)
+
+    def filter(self, **conditions):
+        return self.take(self.indices(**conditions))
+
+    def sort(self, field, reverse=False):
+        column = self.columns[field]
+        present = [i for i in range(len(self)) if column[i] is not None]
+        missing = [i for i in range(len(self)) if column[i] is None]
+        present.sort(key=column.__getitem__, reverse=reverse)
+        return self.take(present + missing)
+
+    def sum(self, field):
+        return sum(self.columns[field].present())
+
+    def mean(self, field):
+        values = self.columns[field].present()
+        return sum(values) / float(len(values)) if values else None
+
+    def min(self, field):
+        values = self.columns[field].present()
+        return min(values) if values else None
+
+    def max(self, field):
+        values = self.columns[field].present()
+        return max(values) if values else None
+
+    def count_by(self, field):
+        column = self.columns[field]
+        counts = {}
+        if isinstance(column, CategoryColumn):
+            for code in column.codes:
+                value = column.values[code]
+                counts[value] = counts.get(value, 0) + 1
+            return counts
+        for i in range(len(column)):
+            counts[column[i]] = counts.get(column[i], 0) + 1
+        return counts
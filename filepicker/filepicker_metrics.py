@@ -0,0 +1,192 @@
+import bisect
+import logging
+import threading
+
+
+logger = logging.getLogger('filepicker')
+
+
+class EventHooks(object):
+
+    EVENTS = ('request_start', 'request_end', 'retry', 'cache_hit',
+              'cache_miss', 'pool_wait')
+
+    def __init__(self):
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback, events=None):
+        with self._lock:
+            self._listeners = self._listeners + [
+                (callback, frozenset(events) if events else None)]
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._listeners = [(c, e) for c, e in self._listeners
+                               if c is not callback]
+
+    def emit(self, event, **data):
+        for callback, events in self._listeners:
+            if events is not None and event not in events:
+                continue
+            try:
+                callback(event, data)
+            except Exception:
+                logger.exception('Hook %r failed on %s', callback, event)
+
+
+class LatencyHistogram(object):
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                       5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if i == len(self.buckets):
+                    return self.max
+                return min(self.buckets[i], self.max)
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum, 'min': self.min,
+                'max': self.max, 'p50': self.percentile(0.5),
+                'p90': self.percentile(0.9), 'p99': self.percentile(0.99),
+                'buckets': list(zip(self.buckets + (float('inf'),),
+                                    self.counts))}
+
+
+class MetricsCollector(object):
+
+    def __init__(self, buckets=LatencyHistogram.DEFAULT_BUCKETS,
+                 exporters=None):
+        self.buckets = buckets
+        self.exporters = list(exporters or [])
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __call__(self, event, data):
+        handler = getattr(self, '_on_' + event, None)
+        if handler is not None:
+            with self._lock:
+                handler(data)
+
+    def attach(self, hooks):
+        return hooks.subscribe(self)
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+            self._caches = {}
+            self._pool_waits = {}
+
+    def _endpoint(self, name):
+        stats = self._endpoints.get(name)
+        if stats is None:
+            stats = self._endpoints[name] = {
+                'requests': 0, 'errors': 0, 'retries': 0, 'statuses': {},
+                'bytes_sent': 0, 'bytes_received': 0,
+                'latency': LatencyHistogram(self.buckets)}
+        return stats
+
+    def _on_request_end(self, data):
+        stats = self._endpoint(data['endpoint'])
+        stats['requests'] += 1
+        if data.get('error') is not None:
+            stats['errors'] += 1
+        else:
+            status = data.get('status_code')
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+        stats['bytes_sent'] += data.get('bytes_sent') or 0
+        stats['bytes_received'] += data.get('bytes_received') or 0
+        stats['latency'].observe(data['latency'])
+
+    def _on_retry(self, data):
+        self._endpoint(data['endpoint'])['retries'] += 1
+
+    def _on_cache_hit(self, data):
+        self._cache(data['cache'])['hits'] += 1
+
+    def _on_cache_miss(self, data):
+        self._cache(data['cache'])['misses'] += 1
+
+    def _on_pool_wait(self, data):
+        kind = data['kind']
+        waits = self._pool_waits.setdefault(kind, {'count': 0, 'seconds': 0.0})
+        waits['count'] += 1
+        waits['seconds'] += data['waited']
+
+    def _cache(self, name):
+        return self._caches.setdefault(name, {'hits': 0, 'misses': 0})
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = {}
+            for name, stats in self._endpoints.items():
+                stats = dict(stats, statuses=dict(stats['statuses']))
+                stats['latency'] = stats['latency'].snapshot()
+                endpoints[name] = stats
+            return {'endpoints': endpoints,
+                    'caches': dict((k, dict(v))
+                                   for k, v in self._caches.items()),
+                    'pool_waits': dict((k, dict(v))
+                                       for k, v in self._pool_waits.items())}
+
+    def export(self):
+        snapshot = self.snapshot()
+        for exporter in self.exporters:
+            exporter.export(snapshot)
+        return snapshot
+
+
+class MetricsExporter(object):
+
+    def export(self, snapshot):
+        raise NotImplementedError
+
+
+class LoggingExporter(MetricsExporter):
+
+    def __init__(self, logger=logger, level=logging.INFO):
+        self.logger = logger
+        self.level = level
+
+    def export(self, snapshot):
+        for name, stats in sorted(snapshot['endpoints'].items()):
+            latency = stats['latency']
+            self.logger.log(
+                self.level,
+                '%s: %d requests, %d errors, %d retries, p50=%ss p99=%ss, '
+                '%d bytes sent, %d bytes received', name, stats['requests'],
+                stats['errors'], stats['retries'], latency['p50'],
+                latency['p99'], stats['bytes_sent'], stats['bytes_received'])
+        for name, stats in sorted(snapshot['caches'].items()):
+            self.logger.log(self.level, '%s: %d hits, %d misses', name,
+                            stats['hits'], stats['misses'])
+        for kind, stats in sorted(snapshot['pool_waits'].items()):
+            self.logger.log(self.level, '%s wait: %d times, %.3fs', kind,
+                            stats['count'], stats['seconds'])
@@ -0,0 +1,256 @@
+import mimetypes
+import mmap
+import os
+import uuid
+
+
+MAGIC_NUMBERS = [
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'BM', 'image/bmp'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (8, b'WEBP', 'image/webp'),
+    (4, b'ftyp', 'video/mp4'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'OggS', 'audio/ogg'),
+]
+SNIFF_SIZE = 16
+
+
+def to_bytes(data):
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return bytes(data)
+
+
+def guess_mimetype(head=None, filename=None):
+    if filename:
+        mimetype = mimetypes.guess_type(filename)[0]
+        if mimetype and mimetype != 'application/octet-stream':
+            return mimetype
+    if head:
+        head = to_bytes(head[:SNIFF_SIZE])
+        for offset, magic, mimetype in MAGIC_NUMBERS:
+            if head[offset:offset + len(magic)] == magic:
+                return mimetype
+    return 'application/octet-stream'
+
+
+class FileSource(object):
+
+    def __init__(self, filepath, use_mmap=False):
+        self._file = open(filepath, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._mmap = None
+        self._pos = 0
+        if use_mmap and self.size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+
+    def read(self, size):
+        if self._mmap is not None:
+            chunk = self._mmap[self._pos:self._pos + size]
+        else:
+            chunk = self._file.read(size)
+        if not chunk and self._pos < self.size:
+            raise IOError('File changed during upload')
+        self._pos += len(chunk)
+        return chunk
+
+    def rewind(self):
+        self._pos = 0
+        self._file.seek(0)
+        return True
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+
+class BufferSource(object):
+
+    def __init__(self, data):
+        self._view = memoryview(data)
+        if self._view.ndim != 1 or self._view.itemsize != 1:
+            if hasattr(self._view, 'cast'):
+                self._view = self._view.cast('B')
+            else:
+                self._view = memoryview(self._view.tobytes())
+        self.size = len(self._view)
+        self._pos = 0
+
+    def head(self):
+        return self._view[:SNIFF_SIZE]
+
+    def read(self, size):
+        chunk = self._view[self._pos:self._pos + size]
+        self._pos += len(chunk)
+        return chunk
+
+    def rewind(self):
+        self._pos = 0
+        return True
+
+    def close(self):
+        if hasattr(self._view, 'release'):
+            self._view.release()
+
+
+class StreamSource(object):
+
+    def __init__(self, stream, size=None):
+        self._stream = stream
+        self._buffered = b''
+        try:
+            self._start = stream.tell()
+        except (AttributeError, IOError, OSError):
+            self._start = None
+        if size is None and self._start is not None:
+            try:
+                size = stream.seek(0, os.SEEK_END) - self._start
+                stream.seek(self._start)
+            except (AttributeError, IOError, OSError, TypeError):
+                size = None
+        self.size = size
+
+    def head(self):
+        if not self._buffered:
+            self._buffered = self._stream.read(SNIFF_SIZE) or b''
+        return self._buffered
+
+    def read(self, size):
+        if self._buffered:
+            chunk, self._buffered = self._buffered[:size], \
+                self._buffered[size:]
+            return chunk
+        return self._stream.read(size) or b''
+
+    def rewind(self):
+        if self._start is None:
+            return False
+        self._buffered = b''
+        self._stream.seek(self._start)
+        return True
+
+    def close(self):
+        pass
+
+
+class MultipartEncoder(object):
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, source, field_name='fileUpload', filename=None,
+                 mimetype=None, chunk_size=CHUNK_SIZE,
+                 progress_callback=None):
+        if mimetype is None:
+            head = source.head() if hasattr(source, 'head') else None
+            mimetype = guess_mimetype(head, filename)
+        self.source = source
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(
+            self.boundary)
+        self.chunk_size = chunk_size
+        self.progress_callback = progress_callback
+
+        self._header = (
+            '--{}\r\n'
+            'Content-Disposition: form-data; name="{}"; filename="{}"\r\n'
+            'Content-Type: {}\r\n\r\n').format(
+                self.boundary, field_name,
+                (filename or 'upload').replace('"', '%22'),
+                mimetype).encode('utf-8')
+        self._footer = '\r\n--{}--\r\n'.format(self.boundary).encode('utf-8')
+        self.len = None
+        if source.size is not None:
+            self.len = len(self._header) + source.size + len(self._footer)
+        self._parts = [self._header, None, self._footer]
+        self._part = 0
+        self._offset = 0
+        self._sent = 0
+
+    def __len__(self):
+        if self.len is None:
+            raise TypeError('Stream length is unknown')
+        return self.len
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not len(chunk):
+                return
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def body(self):
+        return self if self.len is not None else iter(self)
+
+    @property
+    def headers(self):
+        headers = {'Content-Type': self.content_type}
+        if self.len is not None:
+            headers['Content-Length'] = str(self.len)
+        return headers
+
+    def tell(self):
+        return self._sent
+
+    def rewind(self):
+        if not self.source.rewind():
+            return False
+        self._part = self._offset = self._sent = 0
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(to_bytes(chunk) for chunk in iter(
+                lambda: self._read_part(self.chunk_size), b''))
+        chunk = self._read_part(size)
+        if len(chunk) and self.progress_callback:
+            self.progress_callback(self._sent, self.len)
+        return chunk
+
+    def _read_part(self, size):
+        while self._part < len(self._parts):
+            part = self._parts[self._part]
+            if part is None:
+                chunk = self.source.read(size)
+            else:
+                chunk = part[self._offset:self._offset + size]
+                self._offset += len(chunk)
+            if len(chunk):
+                self._sent += len(chunk)
+                return chunk
+            self._part += 1
+            self._offset = 0
+        return b''
+
+    def close(self):
+        self.source.close()
+
+
+class MultipartFileEncoder(MultipartEncoder):
+
+    def __init__(self, filepath, field_name='fileUpload', filename=None,
+                 mimetype=None, chunk_size=MultipartEncoder.CHUNK_SIZE,
+                 use_mmap=False, progress_callback=None):
+        filename = filename or os.path.basename(filepath)
+        mimetype = mimetype or guess_mimetype(filename=filepath)
+        super(MultipartFileEncoder, self).__init__(
+            FileSource(filepath, use_mmap=use_mmap), field_name=field_name,
+            filename=filename, mimetype=mimetype, chunk_size=chunk_size,
+            progress_callback=progress_callback)
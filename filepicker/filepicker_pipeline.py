@@ -0,0 +1,188 @@
+import threading
+import zlib
+from collections import namedtuple
+
+try:
+    from queue import Queue, Empty, Full
+except ImportError:
+    from Queue import Queue, Empty, Full
+
+from .filepicker_download import hexdigests, new_hashers
+
+
+UploadResult = namedtuple('UploadResult', ['file', 'size', 'digests'])
+
+
+class GzipCompressor(object):
+
+    def __init__(self, level=6):
+        self._zlib = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def __call__(self, chunk):
+        return self._zlib.compress(chunk)
+
+    def flush(self):
+        return self._zlib.flush()
+
+
+class GzipDecompressor(object):
+
+    def __init__(self):
+        self._zlib = zlib.decompressobj(31)
+
+    def __call__(self, chunk):
+        return self._zlib.decompress(chunk)
+
+    def flush(self):
+        return self._zlib.flush()
+
+
+class ChunkPipeline(object):
+
+    POLL_INTERVAL = 0.1
+    _DONE = object()
+
+    def __init__(self, chunks, hash_names=('md5',), transform=None,
+                 queue_size=4):
+        self.chunks = chunks
+        self.hashers = new_hashers(hash_names)
+        self.transform = transform() if transform is not None else None
+        self.size = 0
+        self._raw = Queue(queue_size)
+        self._out = Queue(queue_size)
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._produce),
+                         threading.Thread(target=self._process)]
+        for thread in self._threads:
+            thread.daemon = True
+
+    @property
+    def digests(self):
+        return hexdigests(self.hashers)
+
+    def __iter__(self):
+        for thread in self._threads:
+            thread.start()
+        while True:
+            chunk, error = self._out.get()
+            if error is not None:
+                raise error
+            if chunk is self._DONE:
+                return
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _put(self, queue, item):
+        while not self._stop.is_set():
+            try:
+                queue.put(item, timeout=self.POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _get(self, queue):
+        while not self._stop.is_set():
+            try:
+                return queue.get(timeout=self.POLL_INTERVAL)
+            except Empty:
+                pass
+        return self._DONE, None
+
+    def _produce(self):
+        try:
+            for chunk in self.chunks:
+                if not self._put(self._raw, (chunk, None)):
+                    return
+            self._put(self._raw, (self._DONE, None))
+        except Exception as e:
+            self._put(self._raw, (None, e))
+
+    def _process(self):
+        hashers = list(self.hashers.values())
+        transform = self.transform
+        try:
+            while True:
+                chunk, error = self._get(self._raw)
+                if error is not None:
+                    self._put(self._out, (None, error))
+                    return
+                if chunk is self._DONE:
+                    break
+                self.size += len(chunk)
+                for h in hashers:
+                    h.update(chunk)
+                if transform is not None:
+                    chunk = transform(chunk)
+                if len(chunk) and not self._put(self._out, (chunk, None)):
+                    return
+            if transform is not None and hasattr(transform, 'flush'):
+                tail = transform.flush()
+                if len(tail):
+                    self._put(self._out, (tail, None))
+            self._put(self._out, (self._DONE, None))
+        except Exception as e:
+            self._put(self._out, (None, e))
+
+    def close(self):
+        self._stop.set()
+        for thread in self._threads:
+            if thread.ident is not None:
+                thread.join()
+        close = getattr(self.chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+class PipelineSource(object):
+
+    def __init__(self, source, hash_names=('md5',), transform=None,
+                 queue_size=4, chunk_size=1024 * 1024):
+        self.source = source
+        self.hash_names = hash_names
+        self.transform = transform
+        self.queue_size = queue_size
+        self.chunk_size = chunk_size
+        self.size = source.size if transform is None else None
+        self.pipeline = None
+        self._chunks = None
+        self._buffer = b''
+
+    @property
+    def digests(self):
+        return self.pipeline.digests if self.pipeline else {}
+
+    def _start(self):
+        source, chunk_size = self.source, self.chunk_size
+        self.pipeline = ChunkPipeline(
+            iter(lambda: source.read(chunk_size), b''),
+            hash_names=self.hash_names, transform=self.transform,
+            queue_size=self.queue_size)
+        self._chunks = iter(self.pipeline)
+
+    def read(self, size):
+        if self._chunks is None:
+            self._start()
+        if not len(self._buffer):
+            self._buffer = memoryview(next(self._chunks, b''))
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+    def rewind(self):
+        if self.pipeline is not None:
+            self.pipeline.close()
+        if not self.source.rewind():
+            return False
+        self.pipeline = self._chunks = None
+        self._buffer = b''
+        return True
+
+    def close(self):
+        if self.pipeline is not None:
+            self.pipeline.close()
+        self.source.close()
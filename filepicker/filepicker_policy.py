@@ -1,19 +1,53 @@
+import copy
 import json
 import base64
 import hmac
 import hashlib
 
+try:
+    import urllib.parse as parser
+except ImportError:
+    import urllib as parser
+
 
 class FilepickerPolicy(object):
 
+    FILE_API_URL = 'https://www.filepicker.io/api/file/'
+
     def __init__(self, policy, app_secret):
         self.policy = policy
         self.app_secret = app_secret
+        self._signed = None
+        self._hmac = None
 
     def signature_params(self):
+        signed = self._signed
+        if (signed is None or signed[0] != self.app_secret or
+                signed[1] != self.policy):
+            params = self.sign(self.policy)
+            self._signed = signed = (self.app_secret,
+                                     copy.deepcopy(self.policy), params)
+        return dict(signed[2])
+
+    def sign(self, policy):
         policy_enc = base64.urlsafe_b64encode(
-                         json.dumps(self.policy).encode('utf-8'))
-        signature = hmac.new(self.app_secret.encode('utf-8'),
-                             policy_enc,
-                             hashlib.sha256).hexdigest()
-        return {'signature': signature, 'policy': policy_enc}
+                         json.dumps(policy).encode('utf-8'))
+        signer = self._keyed_hmac().copy()
+        signer.update(policy_enc)
+        return {'signature': signer.hexdigest(), 'policy': policy_enc}
+
+    def sign_handles(self, handles, base_url=FILE_API_URL):
+        urls = []
+        for handle in handles:
+            params = self.sign(dict(self.policy, handle=handle))
+            urls.append(base_url + handle + '?' + parser.urlencode(params))
+        return urls
+
+    def _keyed_hmac(self):
+        keyed = self._hmac
+        if keyed is None or keyed[0] != self.app_secret:
+            self._hmac = keyed = (
+                self.app_secret,
+                hmac.new(self.app_secret.encode('utf-8'),
+                         digestmod=hashlib.sha256))
+        return keyed[1]
@@ -0,0 +1,138 @@
+import threading
+import time
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+
+def endpoint_for(method, url):
+    path = urlsplit(url).path.rstrip('/')
+    if '/api/store/' in path:
+        return 'store'
+    if path.endswith('/convert'):
+        return 'convert'
+    if path.endswith('/metadata'):
+        return 'metadata'
+    if method == 'DELETE':
+        return 'delete'
+    if method in ('GET', 'HEAD'):
+        return 'download'
+    return 'overwrite'
+
+
+class TokenBucket(object):
+
+    EPSILON = 1e-9
+
+    def __init__(self, rate, burst=None, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        with self._lock:
+            self._refill()
+            if self._tokens + self.EPSILON >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens + self.EPSILON >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            self.sleep(delay)
+            waited += delay
+
+
+class RateLimiter(object):
+
+    ENDPOINTS = ('store', 'convert', 'metadata', 'download', 'delete',
+                 'overwrite')
+
+    def __init__(self, rates=None, default_rate=None, burst=None,
+                 clock=time.time, sleep=time.sleep):
+        self.buckets = {}
+        for endpoint in self.ENDPOINTS:
+            rate = (rates or {}).get(endpoint, default_rate)
+            if rate:
+                self.buckets[endpoint] = TokenBucket(rate, burst=burst,
+                                                     clock=clock,
+                                                     sleep=sleep)
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, endpoint):
+        bucket = self.buckets.get(endpoint)
+        if bucket is None:
+            return 0.0
+        waited = bucket.acquire()
+        if waited:
+            with self._lock:
+                self.waited += waited
+        return waited
+
+
+class AdaptiveConcurrencyLimiter(object):
+
+    def __init__(self, initial_limit=8, min_limit=1, max_limit=64,
+                 decrease_factor=0.7, latency_tolerance=2.0,
+                 smoothing=0.1):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.baselines = {}
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, status_code=None, latency=None, endpoint=None):
+        with self._condition:
+            self.in_flight -= 1
+            slow = self._is_slow(latency, endpoint)
+            if latency is not None:
+                self._update_baseline(latency, endpoint)
+            if status_code == 429 or slow:
+                self.limit = max(self.min_limit,
+                                 self.limit * self.decrease_factor)
+            elif status_code is not None and status_code < 500:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def _is_slow(self, latency, endpoint=None):
+        baseline = self.baselines.get(endpoint)
+        return (latency is not None and baseline is not None and
+                latency > baseline * self.latency_tolerance)
+
+    def _update_baseline(self, latency, endpoint=None):
+        baseline = self.baselines.get(endpoint)
+        if baseline is None:
+            self.baselines[endpoint] = latency
+        else:
+            self.baselines[endpoint] = baseline + self.smoothing * (
+                latency - baseline)
@@ -0,0 +1,145 @@
+import random
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from .filepicker_exceptions import FilepickerException
+
+
+class CircuitOpenError(FilepickerException):
+    pass
+
+
+def _not_sent(error):
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0] if error.args else None, 'reason', None)
+    return isinstance(reason, NewConnectionError)
+
+
+class RetryPolicy(object):
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+    def __init__(self, max_retries=3, backoff_factor=0.5, max_backoff=30,
+                 jitter=True, statuses=RETRY_STATUSES,
+                 idempotent_methods=IDEMPOTENT_METHODS,
+                 respect_retry_after=True, sleep=time.sleep):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.statuses = statuses
+        self.idempotent_methods = idempotent_methods
+        self.respect_retry_after = respect_retry_after
+        self.sleep = sleep
+        self.retries = 0
+        self.giveups = 0
+        self._lock = threading.Lock()
+
+    def should_retry(self, method, attempt, response=None, error=None):
+        if error is not None:
+            retryable = (method in self.idempotent_methods or
+                         _not_sent(error))
+        else:
+            retryable = response.status_code in self.statuses and (
+                method in self.idempotent_methods or
+                response.status_code == 429)
+        if not retryable:
+            return False
+        if attempt >= self.max_retries:
+            with self._lock:
+                self.giveups += 1
+            return False
+        return True
+
+    def backoff(self, attempt, response=None):
+        retry_after = self.retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        delay = min(self.backoff_factor * (2 ** attempt), self.max_backoff)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def retry_after(self, response):
+        if not self.respect_retry_after or response is None:
+            return None
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            date = parsedate_tz(value)
+            if date is None:
+                return None
+            return max(0.0, mktime_tz(date) - time.time())
+
+    def wait(self, attempt, response=None):
+        with self._lock:
+            self.retries += 1
+        self.sleep(self.backoff(attempt, response))
+
+    def stats(self):
+        return {'retries': self.retries, 'giveups': self.giveups}
+
+
+class CircuitBreaker(object):
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30,
+                 clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.opened = 0
+        self.rejected = 0
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def before_request(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state['state'] == self.CLOSED:
+                return
+            if (state['state'] == self.OPEN and
+                    self.clock() - state['opened_at'] >= self.reset_timeout):
+                state['state'] = self.HALF_OPEN
+                return
+            self.rejected += 1
+        raise CircuitOpenError('Circuit open for {}'.format(host))
+
+    def record_success(self, host):
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def record_failure(self, host):
+        with self._lock:
+            state = self._hosts.setdefault(
+                host, {'state': self.CLOSED, 'failures': 0, 'opened_at': 0})
+            state['failures'] += 1
+            if (state['state'] == self.HALF_OPEN or
+                    state['failures'] >= self.failure_threshold):
+                if state['state'] != self.OPEN:
+                    self.opened += 1
+                state['state'] = self.OPEN
+                state['opened_at'] = self.clock()
+
+    def state(self, host):
+        state = self._hosts.get(host)
+        return state['state'] if state else self.CLOSED
+
+    def stats(self):
+        with self._lock:
+            hosts = dict((host, state['state'])
+                         for host, state in self._hosts.items())
+        return {'opened': self.opened, 'rejected': self.rejected,
+                'hosts': hosts}
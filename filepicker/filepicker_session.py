@@ -0,0 +1,199 @@
+import threading
+import time
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .filepicker_ratelimit import endpoint_for
+from .filepicker_retry import CircuitBreaker, RetryPolicy
+
+
+class FilepickerSession(requests.Session):
+
+    DEFAULT_POOL_CONNECTIONS = 10
+    DEFAULT_POOL_MAXSIZE = 10
+
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False,
+                 keep_alive=True, retry_policy=None, circuit_breaker=None,
+                 rate_limiter=None, concurrency_limiter=None,
+                 event_hooks=None):
+        super(FilepickerSession, self).__init__()
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              pool_block=pool_block)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        if not keep_alive:
+            self.headers['Connection'] = 'close'
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        if circuit_breaker is None:
+            circuit_breaker = CircuitBreaker()
+        self.retry_policy = retry_policy or None
+        self.circuit_breaker = circuit_breaker or None
+        self.rate_limiter = rate_limiter
+        self.concurrency_limiter = concurrency_limiter
+        self.event_hooks = event_hooks
+        self._local = threading.local()
+
+    def send(self, request, **kwargs):
+        if getattr(self._local, 'sending', False):
+            return super(FilepickerSession, self).send(request, **kwargs)
+        if self.event_hooks is None:
+            return self._send_with_retries(request, **kwargs)
+        info = {'method': request.method, 'url': request.url,
+                'endpoint': endpoint_for(request.method, request.url)}
+        self.event_hooks.emit('request_start', **info)
+        response = error = None
+        start = time.time()
+        try:
+            response = self._send_with_retries(request, **kwargs)
+            return response
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.event_hooks.emit(
+                'request_end', latency=time.time() - start,
+                status_code=getattr(response, 'status_code', None),
+                bytes_sent=self._bytes_sent(request),
+                bytes_received=self._bytes_received(response,
+                                                    kwargs.get('stream')),
+                error=error, **info)
+
+    def _send_with_retries(self, request, **kwargs):
+        host = urlsplit(request.url).netloc
+        retry, breaker = self.retry_policy, self.circuit_breaker
+        attempt = 0
+        while True:
+            if breaker:
+                breaker.before_request(host)
+            try:
+                response = self._send(request, **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                if breaker:
+                    breaker.record_failure(host)
+                if not (retry and
+                        retry.should_retry(request.method, attempt,
+                                           error=e) and
+                        self._rewind(request)):
+                    raise
+                self._emit('retry', request, attempt=attempt, error=e)
+                retry.wait(attempt)
+                attempt += 1
+                continue
+            except BaseException:
+                if breaker:
+                    breaker.record_failure(host)
+                raise
+
+            if breaker:
+                if response.status_code >= 500:
+                    breaker.record_failure(host)
+                else:
+                    breaker.record_success(host)
+            if (retry and
+                    retry.should_retry(request.method, attempt,
+                                       response=response) and
+                    self._rewind(request)):
+                response.close()
+                self._emit('retry', request, attempt=attempt,
+                           status_code=response.status_code)
+                retry.wait(attempt, response)
+                attempt += 1
+                continue
+            return response
+
+    def _send(self, request, **kwargs):
+        if self.rate_limiter:
+            waited = self.rate_limiter.acquire(endpoint_for(request.method,
+                                                            request.url))
+            if waited:
+                self._emit('pool_wait', request, kind='rate_limit',
+                           waited=waited)
+        limiter = self.concurrency_limiter
+        if not limiter:
+            return self._send_request(request, **kwargs)
+        start = time.time()
+        limiter.acquire()
+        if self.event_hooks is not None:
+            self._emit('pool_wait', request, kind='concurrency',
+                       waited=time.time() - start)
+        status_code = latency = None
+        try:
+            start = time.time()
+            response = self._send_request(request, **kwargs)
+            status_code, latency = response.status_code, time.time() - start
+            return response
+        finally:
+            limiter.release(status_code, latency,
+                            endpoint_for(request.method, request.url))
+
+    def _send_request(self, request, **kwargs):
+        # requests follows redirects by calling send() again on this
+        # thread; those hops reuse the rate limit token, concurrency slot
+        # and breaker trial already held by the original request.
+        self._local.sending = True
+        try:
+            return super(FilepickerSession, self).send(request, **kwargs)
+        finally:
+            self._local.sending = False
+
+    def _emit(self, event, request, **data):
+        if self.event_hooks is not None:
+            self.event_hooks.emit(
+                event, method=request.method, url=request.url,
+                endpoint=endpoint_for(request.method, request.url), **data)
+
+    def _bytes_sent(self, request):
+        body = request.body
+        if hasattr(body, 'tell') and hasattr(body, 'rewind'):
+            return body.tell()
+        if isinstance(body, (bytes, str)):
+            return len(body)
+        return int(request.headers.get('Content-Length') or 0)
+
+    def _bytes_received(self, response, stream=False):
+        if response is None:
+            return 0
+        length = response.headers.get('Content-Length')
+        if length is not None:
+            return int(length)
+        return 0 if stream else len(response.content)
+
+    def _rewind(self, request):
+        body = request.body
+        if body is None or isinstance(body, (bytes, str)):
+            return True
+        if hasattr(body, 'rewind'):
+            return body.rewind()
+        if hasattr(body, 'seek') and hasattr(body, 'read'):
+            try:
+                body.seek(0)
+                return True
+            except (IOError, OSError):
+                return False
+        return False
+
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+def get_default_session():
+    global _default_session
+    if _default_session is None:
+        with _default_session_lock:
+            if _default_session is None:
+                _default_session = FilepickerSession()
+    return _default_session
@@ -0,0 +1,82 @@
+import json
+import math
+import threading
+import time
+
+try:
+    import urllib.parse as parser
+except ImportError:
+    import urllib as parser
+
+from .filepicker_policy import FilepickerPolicy
+
+
+class URLSigner(object):
+
+    def __init__(self, policy, ttl=None, bucket=300, per_handle=True,
+                 base_url=FilepickerPolicy.FILE_API_URL, max_size=100000,
+                 clock=time.time):
+        self.policy = policy
+        self.ttl = ttl
+        self.bucket = bucket
+        self.per_handle = per_handle
+        self.base_url = base_url
+        self.max_size = max_size
+        self.clock = clock
+        self.signed = 0
+        self._cache = {}
+        self._cache_key = None
+        self._lock = threading.Lock()
+
+    def expiry(self):
+        if self.ttl is None:
+            return None
+        return int(math.ceil((self.clock() + self.ttl) /
+                             float(self.bucket)) * self.bucket)
+
+    def queries(self, handles):
+        expiry = self.expiry()
+        template = self.policy.policy
+        if expiry is not None:
+            template = dict(template, expiry=expiry)
+        cache_key = (self.policy.app_secret, expiry,
+                     json.dumps(self.policy.policy, sort_keys=True))
+        with self._lock:
+            if (cache_key != self._cache_key or
+                    len(self._cache) >= self.max_size):
+                self._cache = {}
+                self._cache_key = cache_key
+            cache = self._cache
+
+        queries = []
+        for handle in handles:
+            key = handle if self.per_handle else None
+            query = cache.get(key)
+            if query is None:
+                policy = (dict(template, handle=handle) if self.per_handle
+                          else template)
+                query = parser.urlencode(self.policy.sign(policy))
+                with self._lock:
+                    cache[key] = query
+                    self.signed += 1
+            queries.append(query)
+        return queries
+
+    def sign_urls(self, handles):
+        handles = list(handles)
+        base_url = self.base_url
+        return [base_url + handle + '?' + query
+                for handle, query in zip(handles, self.queries(handles))]
+
+    def convert_urls(self, handles, **params):
+        handles = list(handles)
+        base_url = self.base_url
+        prefix = '/convert?' + parser.urlencode(params) + '&'
+        return [base_url + handle + prefix + query
+                for handle, query in zip(handles, self.queries(handles))]
+
+    def sign_url(self, handle):
+        return self.sign_urls([handle])[0]
+
+    def convert_url(self, handle, **params):
+        return self.convert_urls([handle], **params)[0]
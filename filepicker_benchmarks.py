@@ -0,0 +1,232 @@
+import argparse
+import io
+import json
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+from filepicker import FilepickerClient, FilepickerPolicy, URLSigner
+
+
+class MockFilepickerServer(object):
+
+    def __init__(self, latency=0.0, payload_size=64 * 1024):
+        self.latency = latency
+        self.payload = b'x' * payload_size
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                self.connection.setsockopt(socket.IPPROTO_TCP,
+                                           socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def respond(self, body, content_type='application/json'):
+                if mock.latency:
+                    time.sleep(mock.latency)
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def read_body(self):
+                if self.headers.get('Transfer-Encoding') != 'chunked':
+                    length = int(self.headers.get('Content-Length') or 0)
+                    return self.rfile.read(length)
+                size = 0
+                while True:
+                    length = int(self.rfile.readline().strip(), 16)
+                    size += len(self.rfile.read(length))
+                    self.rfile.readline()
+                    if not length:
+                        return size
+
+            def stored(self, size, mimetype='application/octet-stream'):
+                return json.dumps({
+                    'url': '{}/api/file/{}'.format(mock.url,
+                                                   uuid.uuid4().hex),
+                    'size': size, 'type': mimetype,
+                    'filename': 'benchmark.bin'}).encode('utf-8')
+
+            def do_POST(self):
+                body = self.read_body()
+                size = body if isinstance(body, int) else len(body)
+                if self.path.split('?')[0].endswith('/convert'):
+                    self.respond(self.stored(size, 'image/png'))
+                else:
+                    self.respond(self.stored(size))
+
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path.endswith('/metadata'):
+                    self.respond(json.dumps({
+                        'size': len(mock.payload),
+                        'mimetype': 'application/octet-stream',
+                        'filename': 'benchmark.bin'}).encode('utf-8'))
+                elif path.endswith('/convert'):
+                    self.respond(mock.payload, 'image/png')
+                else:
+                    self.respond(mock.payload, 'application/octet-stream')
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+            request_queue_size = 128
+
+        self.httpd = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_port)
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       args=(0.05,))
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def peak_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_benchmark(name, operation, operations, concurrency):
+    def timed(i):
+        start = time.time()
+        operation(i)
+        return time.time() - start
+
+    baseline = peak_rss()
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed, range(operations)))
+    elapsed = time.time() - start
+    return {'benchmark': name, 'concurrency': concurrency,
+            'operations': operations,
+            'ops_per_sec': operations / elapsed if elapsed else None,
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+            'rss_growth': peak_rss() - baseline
+            if baseline is not None else None}
+
+
+def benchmarks(server, payload_size):
+    client = FilepickerClient(api_key='BENCHMARK_KEY', pool_maxsize=64)
+    client.API_URL = server.url + '/api'
+    payload = b'x' * payload_size
+    file_url = server.url + '/api/file/BenchmarkHandle'
+    policy = FilepickerPolicy({'expiry': 32503680000, 'call': ['read']},
+                              'BENCHMARK_SECRET')
+
+    def upload(i):
+        client.store_bytes(payload, filename_hint='benchmark.bin')
+
+    def download(i):
+        client.get_file(url=file_url).download_to(io.BytesIO(),
+                                                  hash_names=())
+
+    def metadata(i):
+        client.get_file(url=file_url).update_metadata()
+
+    def convert(i):
+        client.get_file(url=file_url).convert(w=100, storeLocation='S3')
+
+    signer = URLSigner(policy, ttl=3600)
+    page = ['Handle{}'.format(i) for i in range(100)]
+
+    def sign(i):
+        policy.sign_handles(['Handle{}'.format(i)])
+
+    def sign_page(i):
+        signer.convert_urls(page, w=200)
+
+    return client, [('upload', upload), ('download', download),
+                    ('metadata', metadata), ('convert', convert),
+                    ('sign', sign), ('sign_page', sign_page)]
+
+
+def format_result(result):
+    def ms(value):
+        return '{:.2f}'.format(value * 1000) if value is not None else '-'
+
+    rss = result['rss_growth']
+    return '{:<10} {:>5} {:>7} {:>12.1f} {:>9} {:>9} {:>10}'.format(
+        result['benchmark'], result['concurrency'], result['operations'],
+        result['ops_per_sec'] or 0, ms(result['p50']), ms(result['p99']),
+        '{:.1f}'.format(rss / 1048576.0) if rss is not None else '-')
+
+
+def main(argv=None, out=sys.stdout):
+    parser = argparse.ArgumentParser(
+        description='Measure filepicker client throughput and latency '
+                    'against a local mock server.')
+    parser.add_argument('--operations', type=int, default=200)
+    parser.add_argument('--concurrency', default='1,8,32',
+                        help='comma separated concurrency levels')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='server latency per request in seconds')
+    parser.add_argument('--payload-size', type=int, default=64 * 1024,
+                        help='bytes uploaded and downloaded per operation')
+    parser.add_argument('--only', help='comma separated benchmark names')
+    parser.add_argument('--json', action='store_true',
+                        help='print one JSON object per result')
+    args = parser.parse_args(argv)
+
+    levels = [int(c) for c in args.concurrency.split(',')]
+    only = set(args.only.split(',')) if args.only else None
+    results = []
+    with MockFilepickerServer(args.latency, args.payload_size) as server:
+        client, cases = benchmarks(server, args.payload_size)
+        with client:
+            if not args.json:
+                out.write('{:<10} {:>5} {:>7} {:>12} {:>9} {:>9} {:>10}\n'
+                          .format('benchmark', 'conc', 'ops', 'ops/sec',
+                                  'p50 ms', 'p99 ms', 'rss +MiB'))
+            for name, operation in cases:
+                if only and name not in only:
+                    continue
+                for concurrency in levels:
+                    result = run_benchmark(name, operation, args.operations,
+                                           concurrency)
+                    results.append(result)
+                    out.write((json.dumps(result) if args.json else
+                               format_result(result)) + '\n')
+                    out.flush()
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -4,16 +4,139 @@ import hmac
 import hashlib
 import base64
 import os
+import threading
+import time
+import io
+import mmap
+import shutil
 
 try:
     import urllib.parse as urllib
 except ImportError:
     import urllib
 
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
 from httmock import urlmatch, HTTMock, all_requests
 import requests
 
 from filepicker import FilepickerPolicy, FilepickerFile, FilepickerClient
+from filepicker import FilepickerSession, ChecksumMismatch, URLSigner
+from filepicker import FilepickerException
+from filepicker import LRUMetadataCache
+from filepicker import RetryPolicy, CircuitBreaker, CircuitOpenError
+from filepicker import RateLimiter, AdaptiveConcurrencyLimiter
+from filepicker import Converter, Checkpoint
+from filepicker import EventHooks, MetricsCollector, MetricsExporter
+from filepicker import MemoryDedupIndex, SQLiteDedupIndex
+from filepicker import FileSet, ContentCache
+from filepicker import GzipCompressor, GzipDecompressor
+
+from filepicker import filepicker_cli
+import filepicker_benchmarks
+
+try:
+    import asyncio
+    from filepicker import AsyncFilepickerClient, AsyncFilepickerFile
+except ImportError:
+    AsyncFilepickerClient = AsyncFilepickerFile = None
+
+
+class LocalFilepickerServer(object):
+
+    HANDLE = 'LocalHandle'
+    CONTENT = b'local file content' * 64
+    ETAG = '"v1"'
+
+    def __init__(self):
+        test_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def respond(self, status, body, headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def read_body(self):
+                test_server.last_headers = dict(self.headers)
+                if self.headers.get('Transfer-Encoding') != 'chunked':
+                    length = int(self.headers.get('Content-Length') or 0)
+                    return self.rfile.read(length)
+                chunks = []
+                while True:
+                    length = int(self.rfile.readline().strip(), 16)
+                    chunks.append(self.rfile.read(length))
+                    self.rfile.readline()
+                    if not length:
+                        return b''.join(chunks)
+
+            def stored(self, body):
+                return json.dumps({
+                    'url': '{}/api/file/{}'.format(test_server.url,
+                                                   test_server.HANDLE),
+                    'size': len(body), 'type': 'text/plain',
+                    'filename': 'local.txt'}).encode('utf-8')
+
+            def do_POST(self):
+                body = self.read_body()
+                test_server.requests.append(('POST', self.path, body))
+                self.respond(200, self.stored(body))
+
+            def do_GET(self):
+                test_server.requests.append(('GET', self.path,
+                                             self.headers.get('Range')))
+                if self.path.startswith('/redirect'):
+                    self.respond(302, b'', {
+                        'Location': '/api/file/' + test_server.HANDLE})
+                elif '/Forbidden' in self.path:
+                    self.respond(403, b'Invalid API key')
+                elif '/metadata' in self.path:
+                    metadata = {
+                        'size': len(test_server.CONTENT),
+                        'md5': hashlib.md5(test_server.CONTENT).hexdigest()}
+                    self.respond(200, json.dumps(metadata).encode('utf-8'))
+                elif self.headers.get('Range'):
+                    start, end = self.headers['Range'][6:].split('-')
+                    start, end = int(start), int(end)
+                    content_range = 'bytes {}-{}/{}'.format(
+                        start, end, len(test_server.CONTENT))
+                    self.respond(206, test_server.CONTENT[start:end + 1],
+                                 {'Content-Range': content_range})
+                elif self.headers.get('If-None-Match') == test_server.ETAG:
+                    self.respond(304, b'')
+                else:
+                    self.respond(200, test_server.CONTENT,
+                                 {'ETag': test_server.ETAG})
+
+            def do_DELETE(self):
+                test_server.requests.append(('DELETE', self.path, None))
+                self.respond(200, b'success')
+
+        self.requests = []
+        self.last_headers = {}
+        self.httpd = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_port)
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       args=(0.05,))
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
 
 
 class FilepickerPolicyTest(unittest2.TestCase):
@@ -39,6 +162,618 @@ class FilepickerPolicyTest(unittest2.TestCase):
         self.assertEqual(params['policy'], expected_policy)
 
 
+    def test_signature_memoization(self):
+        params = self.policy.signature_params()
+        signed = self.policy._signed
+        self.assertEqual(self.policy.signature_params(), params)
+        self.assertIs(self.policy._signed, signed)
+
+        params['signature'] = 'changed by caller'
+        self.assertNotEqual(self.policy.signature_params(), params)
+
+        self.policy.policy['expiry'] = 1508141505
+        changed = self.policy.signature_params()
+        self.assertNotEqual(changed['policy'], params['policy'])
+        self.assertEqual(changed, FilepickerPolicy(
+            {'handle': self.FILEHANDLE, 'expiry': 1508141505},
+            self.APP_SECRET).signature_params())
+
+        self.policy.app_secret = 'ANOTHER_SECRET'
+        self.assertNotEqual(self.policy.signature_params()['signature'],
+                            changed['signature'])
+
+    def test_sign_handles(self):
+        policy = FilepickerPolicy({'expiry': 1508141504, 'call': 'read'},
+                                  self.APP_SECRET)
+        urls = policy.sign_handles(['abc', 'def'])
+        self.assertEqual(len(urls), 2)
+        for handle, url in zip(['abc', 'def'], urls):
+            expected = FilepickerPolicy(
+                {'expiry': 1508141504, 'call': 'read', 'handle': handle},
+                self.APP_SECRET).signature_params()
+            self.assertEqual(
+                url, FilepickerFile.FILE_API_URL + handle + '?' +
+                urllib.urlencode(expected))
+
+
+class URLSignerTest(unittest2.TestCase):
+
+    APP_SECRET = 'ABCABCABCABC123123123123XX'
+
+    def setUp(self):
+        self.now = 1000
+        self.policy = FilepickerPolicy({'call': ['read', 'convert']},
+                                       self.APP_SECRET)
+        self.signer = URLSigner(self.policy, ttl=3600, bucket=600,
+                                clock=lambda: self.now)
+
+    def expected(self, handle, expiry):
+        return urllib.urlencode(FilepickerPolicy(
+            {'call': ['read', 'convert'], 'expiry': expiry,
+             'handle': handle}, self.APP_SECRET).signature_params())
+
+    def test_sign_urls(self):
+        urls = self.signer.sign_urls(['abc', 'def', 'abc'])
+        self.assertEqual(urls[0], FilepickerFile.FILE_API_URL + 'abc?' +
+                         self.expected('abc', 4800))
+        self.assertEqual(urls[1], FilepickerFile.FILE_API_URL + 'def?' +
+                         self.expected('def', 4800))
+        self.assertEqual(urls[2], urls[0])
+        self.assertEqual(self.signer.signed, 2)
+
+        self.now += 200
+        self.assertEqual(self.signer.sign_url('abc'), urls[0])
+        self.assertEqual(self.signer.signed, 2)
+        self.now += 1
+        self.assertIn(self.expected('abc', 5400),
+                      self.signer.sign_url('abc'))
+        self.assertEqual(self.signer.signed, 3)
+
+    def test_policy_change(self):
+        url = self.signer.sign_url('abc')
+        self.policy.policy['call'] = ['read']
+        changed = self.signer.sign_url('abc')
+        self.assertNotEqual(changed, url)
+        self.assertIn(urllib.urlencode(FilepickerPolicy(
+            {'call': ['read'], 'expiry': 4800, 'handle': 'abc'},
+            self.APP_SECRET).signature_params()), changed)
+        self.assertEqual(self.signer.signed, 2)
+
+    def test_generator_input(self):
+        urls = self.signer.sign_urls(h for h in ['abc', 'def'])
+        self.assertEqual(urls, self.signer.sign_urls(['abc', 'def']))
+        urls = self.signer.convert_urls((h for h in ['abc']), w=200)
+        self.assertEqual(urls, [self.signer.convert_url('abc', w=200)])
+
+    def test_convert_urls(self):
+        url = self.signer.convert_url('abc', w=200)
+        self.assertEqual(url, FilepickerFile.FILE_API_URL +
+                         'abc/convert?w=200&' + self.expected('abc', 4800))
+
+    def test_shared_signature(self):
+        signer = URLSigner(FilepickerPolicy({'expiry': 1508141504},
+                                            self.APP_SECRET),
+                           per_handle=False)
+        urls = signer.sign_urls(['abc', 'def'])
+        self.assertEqual(signer.signed, 1)
+        self.assertEqual(urls[1].split('?')[1], urls[0].split('?')[1])
+
+        client = FilepickerClient(app_secret=self.APP_SECRET)
+        client.add_policy('read', {'call': 'read'})
+        signer = client.url_signer('read', ttl=60)
+        self.assertIn('signature=', signer.sign_url('abc'))
+
+
+class LRUMetadataCacheTest(unittest2.TestCase):
+
+    def setUp(self):
+        self.now = 1000
+        self.cache = LRUMetadataCache(max_size=2, ttl=10,
+                                      clock=lambda: self.now)
+
+    def test_hits_and_misses(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', {'size': 1})
+        self.assertEqual(self.cache.get('a'), {'size': 1})
+        self.assertEqual(self.cache.stats(),
+                         {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_ttl(self):
+        self.cache.set('a', {'size': 1})
+        self.now += 11
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        self.cache.set('a', {'size': 1})
+        self.cache.set('b', {'size': 2})
+        self.cache.get('a')
+        self.cache.set('c', {'size': 3})
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), {'size': 1})
+        self.assertEqual(self.cache.get('c'), {'size': 3})
+
+
+class SQLiteDedupIndexTest(unittest2.TestCase):
+
+    PATH = 'delete_this_test_leftover.sqlite'
+
+    def setUp(self):
+        self.now = 1000
+        self.index = SQLiteDedupIndex(self.PATH, max_size=2, ttl=60,
+                                      clock=lambda: self.now)
+
+    def tearDown(self):
+        self.index.close()
+        os.remove(self.PATH)
+
+    def test_persistence(self):
+        self.index.set('S3:3:abc', {'url': 'u1', 'size': 3})
+        self.index.close()
+        self.index = SQLiteDedupIndex(self.PATH, clock=lambda: self.now)
+        self.assertEqual(self.index.get('S3:3:abc'), {'url': 'u1', 'size': 3})
+        self.assertIsNone(self.index.get('S3:3:def'))
+        self.assertEqual(self.index.stats(),
+                         {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_eviction(self):
+        self.index.set('a', {'url': 'a'})
+        self.now += 1
+        self.index.set('b', {'url': 'b'})
+        self.now += 1
+        self.index.get('a')
+        self.now += 1
+        self.index.set('c', {'url': 'c'})
+        self.assertIsNone(self.index.get('b'))
+        self.assertEqual(len(self.index), 2)
+
+        self.now += 61
+        self.assertIsNone(self.index.get('a'))
+        self.index.delete('c')
+        self.assertEqual(len(self.index), 0)
+
+
+class FileSetTest(unittest2.TestCase):
+
+    RESPONSES = [
+        {'url': FilepickerFile.FILE_API_URL + 'aaa', 'size': 300,
+         'type': 'image/png', 'filename': 'a.png', 'width': 10,
+         'height': 20},
+        {'url': 'https://cdn.example.com/api/file/bbb', 'size': 100,
+         'type': 'image/jpeg', 'filename': u'b\u00e9.jpg'},
+        {'url': FilepickerFile.FILE_API_URL + 'ccc', 'size': 200,
+         'type': 'image/png', 'uploaded': 1.5e12},
+        {'url': FilepickerFile.FILE_API_URL + 'ddd'},
+    ]
+
+    def setUp(self):
+        self.client = FilepickerClient(api_key='SECRET_API_KEY')
+        self.fileset = FileSet.from_responses(self.RESPONSES,
+                                              client=self.client)
+
+    def test_columns(self):
+        self.assertEqual(len(self.fileset), 4)
+        self.assertEqual(list(self.fileset.handles()),
+                         ['aaa', 'bbb', 'ccc', 'ddd'])
+        self.assertEqual(self.fileset.column('size'), [300, 100, 200, None])
+        self.assertEqual(self.fileset.column('filename'),
+                         ['a.png', u'b\u00e9.jpg', '', ''])
+        self.assertEqual(self.fileset.columns['mimetype'].values,
+                         [None, 'image/png', 'image/jpeg'])
+        self.assertEqual(self.fileset.url(1),
+                         'https://cdn.example.com/api/file/bbb')
+
+    def test_queries(self):
+        pngs = self.fileset.filter(mimetype='image/png')
+        self.assertEqual(list(pngs.handles()), ['aaa', 'ccc'])
+        self.assertEqual(pngs.sum('size'), 500)
+        large = self.fileset.filter(size=lambda s: s is not None and s > 150)
+        self.assertEqual(list(large.handles()), ['aaa', 'ccc'])
+
+        by_size = self.fileset.sort('size')
+        self.assertEqual(list(by_size.handles()), ['bbb', 'ccc', 'aaa', 'ddd'])
+        self.assertEqual(list(self.fileset.sort('size', reverse=True)
+                              .handles())[:3], ['aaa', 'ccc', 'bbb'])
+        self.assertEqual(self.fileset.mean('size'), 200)
+        self.assertEqual(self.fileset.max('uploaded'), 1.5e12)
+        self.assertEqual(self.fileset.min('width'), 10)
+        self.assertEqual(self.fileset.count_by('mimetype'),
+                         {'image/png': 2, 'image/jpeg': 1, None: 1})
+        self.assertEqual(list(self.fileset[1:3].handles()), ['bbb', 'ccc'])
+
+    def test_file_views(self):
+        file = self.fileset[0]
+        self.assertIsInstance(file, FilepickerFile)
+        self.assertEqual(file.handle, 'aaa')
+        self.assertEqual(file.api_key, 'SECRET_API_KEY')
+        self.assertEqual(file.metadata, {'size': 300, 'mimetype': 'image/png',
+                                         'filename': 'a.png', 'width': 10,
+                                         'height': 20})
+        self.assertEqual(self.fileset[3].metadata, {})
+
+        copy = FileSet.from_files(self.fileset)
+        self.assertEqual(copy.row(2), self.fileset.row(2))
+
+    def test_policies_not_shared(self):
+        file = FilepickerFile(handle='aaa', app_secret='SECRET')
+        file.add_policy('read', {'call': 'read'})
+        self.assertEqual(FilepickerFile(handle='bbb').policies, {})
+
+
+class FilepickerSessionTest(unittest2.TestCase):
+
+    URL = 'https://www.filepicker.io/api/file/XX'
+
+    def setUp(self):
+        self.delays = []
+        self.now = 1000
+        self.retry = RetryPolicy(max_retries=3, backoff_factor=1,
+                                 jitter=False, sleep=self.delays.append)
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10,
+                                      clock=lambda: self.now)
+        self.session = FilepickerSession(retry_policy=self.retry,
+                                         circuit_breaker=self.breaker)
+        self.statuses = []
+
+    def api(self):
+        @all_requests
+        def respond(url, request):
+            status = self.statuses.pop(0) if self.statuses else 200
+            if isinstance(status, Exception):
+                raise status
+            headers = {'Retry-After': '7'} if status == 429 else {}
+            if status == 302:
+                headers['Location'] = self.URL + '/moved'
+            return {'status_code': status, 'content': b'ok',
+                    'headers': headers}
+        return HTTMock(respond)
+
+    def test_retry_idempotent(self):
+        self.statuses = [503, 502]
+        with self.api():
+            response = self.session.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.delays, [1, 2])
+        self.assertEqual(self.retry.stats(), {'retries': 2, 'giveups': 0})
+
+    def test_retry_non_idempotent(self):
+        self.statuses = [503]
+        with self.api():
+            self.assertEqual(self.session.post(self.URL).status_code, 503)
+        self.statuses = [429]
+        with self.api():
+            self.assertEqual(self.session.post(self.URL).status_code, 200)
+        self.assertEqual(self.delays, [7])
+
+    def test_give_up(self):
+        self.breaker.failure_threshold = 10
+        self.statuses = [500] * 5
+        with self.api():
+            self.assertEqual(self.session.get(self.URL).status_code, 500)
+        self.assertEqual(self.delays, [1, 2, 4])
+        self.assertEqual(self.retry.giveups, 1)
+
+    def test_circuit_breaker(self):
+        self.retry.max_retries = 0
+        self.statuses = [500] * 3
+        with self.api():
+            for _ in range(3):
+                self.session.get(self.URL)
+            self.assertRaises(CircuitOpenError, self.session.get, self.URL)
+            self.assertEqual(self.breaker.state('www.filepicker.io'),
+                             CircuitBreaker.OPEN)
+
+            self.now += 11
+            self.assertEqual(self.session.get(self.URL).status_code, 200)
+        self.assertEqual(self.breaker.state('www.filepicker.io'),
+                         CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.stats(),
+                         {'opened': 1, 'rejected': 1, 'hosts': {}})
+
+    def test_circuit_breaker_trial_outcomes(self):
+        self.retry.max_retries = 0
+        self.breaker.failure_threshold = 1
+        host = 'www.filepicker.io'
+        self.statuses = [500, requests.exceptions.InvalidHeader('bad'), 302]
+        with self.api():
+            self.session.get(self.URL)
+            self.now += 11
+            self.assertRaises(requests.exceptions.InvalidHeader,
+                              self.session.get, self.URL)
+            self.assertEqual(self.breaker.state(host), CircuitBreaker.OPEN)
+
+            self.now += 11
+            response = self.session.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.history), 1)
+        self.assertEqual(self.breaker.state(host), CircuitBreaker.CLOSED)
+
+    def test_redirect_holds_one_slot(self):
+        server = LocalFilepickerServer().start()
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1)
+        session = FilepickerSession(concurrency_limiter=limiter,
+                                    rate_limiter=RateLimiter(default_rate=100))
+        result = []
+        thread = threading.Thread(target=lambda: result.append(
+            session.get(server.url + '/redirect')))
+        thread.daemon = True
+        try:
+            thread.start()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+            self.assertEqual(result[0].status_code, 200)
+            self.assertEqual(result[0].content, server.CONTENT)
+            self.assertEqual(limiter.in_flight, 0)
+        finally:
+            server.stop()
+
+    def test_retry_after_date(self):
+        response = requests.Response()
+        response.headers['Retry-After'] = 'Wed, 21 Oct 2015 07:28:00 GMT'
+        self.assertEqual(self.retry.retry_after(response), 0)
+
+
+class MetricsCollectorTest(unittest2.TestCase):
+
+    def setUp(self):
+        self.hooks = EventHooks()
+        self.exported = []
+        exporter = MetricsExporter()
+        exporter.export = self.exported.append
+        self.collector = MetricsCollector(exporters=[exporter])
+        self.collector.attach(self.hooks)
+        self.events = []
+        self.hooks.subscribe(lambda event, data: self.events.append(event),
+                             events=['request_start', 'retry'])
+
+    def test_request_metrics(self):
+        statuses = [503, 200, 200]
+
+        @all_requests
+        def respond(url, request):
+            return {'status_code': statuses.pop(0),
+                    'content': b'{"size": 5}',
+                    'headers': {'Content-Length': '11'}}
+
+        client = FilepickerClient(
+            api_key='KEY', event_hooks=self.hooks,
+            retry_policy=RetryPolicy(sleep=lambda delay: None),
+            metadata_cache=LRUMetadataCache(event_hooks=self.hooks))
+        with HTTMock(respond):
+            file = client.get_file(handle='XX')
+            file.download_to(io.BytesIO())
+            file.update_metadata()
+        client.get_file(handle='XX')
+
+        self.assertEqual(self.events,
+                         ['request_start', 'retry', 'request_start'])
+        snapshot = self.collector.export()
+        self.assertEqual(self.exported, [snapshot])
+        download = snapshot['endpoints']['download']
+        self.assertEqual(download['requests'], 1)
+        self.assertEqual(download['retries'], 1)
+        self.assertEqual(download['statuses'], {200: 1})
+        self.assertEqual(download['bytes_received'], 11)
+        self.assertEqual(download['latency']['count'], 1)
+        self.assertEqual(snapshot['endpoints']['metadata']['requests'], 1)
+        self.assertEqual(snapshot['caches'],
+                         {'LRUMetadataCache': {'hits': 1, 'misses': 1}})
+
+    def test_failing_listener(self):
+        def broken(event, data):
+            raise ValueError(event)
+
+        self.hooks.subscribe(broken)
+        self.hooks.emit('retry', endpoint='store')
+        self.hooks.unsubscribe(broken)
+        self.assertEqual(
+            self.collector.snapshot()['endpoints']['store']['retries'], 1)
+
+    def test_latency_histogram(self):
+        for latency in [0.001] * 90 + [0.2] * 9 + [42]:
+            self.hooks.emit('request_end', endpoint='convert',
+                            latency=latency, status_code=200)
+        latency = self.collector.snapshot()['endpoints']['convert'][
+            'latency']
+        self.assertEqual(latency['count'], 100)
+        self.assertEqual(latency['p50'], 0.005)
+        self.assertEqual(latency['p99'], 0.25)
+        self.assertEqual(latency['max'], 42)
+        self.assertEqual(latency['buckets'][-1], (float('inf'), 1))
+
+
+class RateLimiterTest(unittest2.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.limiter = RateLimiter(rates={'store': 2}, default_rate=10,
+                                   burst=1, clock=lambda: self.now,
+                                   sleep=self.sleep)
+
+    def sleep(self, delay):
+        self.now += delay
+
+    def test_per_endpoint_rates(self):
+        for _ in range(5):
+            self.limiter.acquire('store')
+        self.assertAlmostEqual(self.now, 2.0)
+        self.now = 10.0
+        for _ in range(5):
+            self.limiter.acquire('metadata')
+        self.assertAlmostEqual(self.now, 10.4)
+        self.assertAlmostEqual(self.limiter.waited, 2.4)
+
+    def test_session_uses_endpoint_budgets(self):
+        session = FilepickerSession(rate_limiter=self.limiter)
+
+        @all_requests
+        def respond(url, request):
+            return {'status_code': 200, 'content': b'{}'}
+
+        with HTTMock(respond):
+            session.post('https://www.filepicker.io/api/store/S3')
+            session.post('https://www.filepicker.io/api/store/S3')
+            self.assertAlmostEqual(self.now, 0.5)
+            session.get('https://www.filepicker.io/api/file/XX/metadata')
+            session.get('https://www.filepicker.io/api/file/XX/metadata')
+            self.assertAlmostEqual(self.now, 0.6)
+
+
+class AdaptiveConcurrencyLimiterTest(unittest2.TestCase):
+
+    def test_limit_adapts(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=10, min_limit=2,
+                                             max_limit=11)
+        limiter.acquire()
+        limiter.release(429, 0.1)
+        self.assertAlmostEqual(limiter.limit, 7)
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release(200, 0.1)
+        self.assertGreater(limiter.limit, 9)
+        limiter.acquire()
+        limiter.release(200, 1.0)
+        self.assertLess(limiter.limit, 8)
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release(429, 0.1)
+        self.assertEqual(limiter.limit, 2)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_baseline_per_endpoint(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=10)
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release(200, 0.005, 'metadata')
+        limit = limiter.limit
+        limiter.acquire()
+        limiter.release(200, 3.0, 'store')
+        self.assertGreater(limiter.limit, limit)
+        limiter.acquire()
+        limiter.release(200, 0.5, 'metadata')
+        self.assertLess(limiter.limit, limit)
+        self.assertEqual(sorted(limiter.baselines), ['metadata', 'store'])
+
+    def test_blocks_at_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1)
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def worker():
+            limiter.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        limiter.release(200, 0.1)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+
+
+class ConverterTest(unittest2.TestCase):
+
+    def setUp(self):
+        self.converter = Converter()
+        self.file = FilepickerFile(handle='ABC', api_key='APIKEY',
+                                   converter=self.converter)
+        self.posts = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def api(self):
+        @urlmatch(netloc=r'www\.filepicker\.io', method='post',
+                  scheme='https')
+        def convert_and_store(url, request):
+            self.posts.append(url)
+            self.release.wait(5)
+            handle = url.path.split('/')[3]
+            content = {'url': 'https://www.filepicker.io/api/file/' +
+                              handle + 'Converted' + str(len(self.posts)),
+                       'type': 'image/png', 'size': 10}
+            return {'status_code': 200,
+                    'content': json.dumps(content).encode('utf-8')}
+        return HTTMock(convert_and_store)
+
+    def test_cached_conversion(self):
+        with self.api():
+            first = self.file.convert(w=10, h=20, storeLocation='S3')
+            second = self.file.convert(h='20', storeLocation='S3', w='10')
+            other = self.file.convert(w=30, storeLocation='S3')
+
+        self.assertEqual(len(self.posts), 2)
+        self.assertEqual(first.url, second.url)
+        self.assertIsNot(first, second)
+        self.assertEqual(second.mimetype, 'image/png')
+        self.assertNotEqual(other.url, first.url)
+        self.assertEqual(self.converter.cache.hits, 1)
+
+        temporary = self.file.convert(w=10)
+        self.assertTrue(temporary.temporary)
+
+    def test_overwrite_invalidates(self):
+        with self.api():
+            first = self.file.convert(w=100, storeLocation='S3')
+            self.file.overwrite(url='http://example.com/new.png')
+            second = self.file.convert(w=100, storeLocation='S3')
+            third = self.file.convert(w=100, storeLocation='S3')
+        self.assertEqual(len(self.posts), 3)
+        self.assertNotEqual(second.url, first.url)
+        self.assertEqual(third.url, second.url)
+
+    def test_cache_is_scoped_to_credentials(self):
+        self.file.set_app_secret('SECRET')
+        self.file.add_policy('wide', {'call': ['read', 'convert']})
+        self.file.add_policy('narrow', {'call': ['read']})
+        with self.api():
+            self.file.convert('wide', w=10, storeLocation='S3')
+            self.file.convert('wide', w=10, storeLocation='S3')
+            self.file.convert('narrow', w=10, storeLocation='S3')
+            self.file.convert(w=10, storeLocation='S3')
+            self.file.set_api_key('OTHERKEY')
+            self.file.convert('wide', w=10, storeLocation='S3')
+        self.assertEqual(len(self.posts), 4)
+        self.assertEqual(self.converter.cache.hits, 1)
+
+    def test_single_flight(self):
+        self.release.clear()
+        results = []
+
+        def convert():
+            results.append(self.file.convert(w=10, storeLocation='S3'))
+
+        with self.api():
+            threads = [threading.Thread(target=convert) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            deadline = time.time() + 5
+            while (self.converter._flight.shared < 3 and
+                   time.time() < deadline):
+                time.sleep(0.01)
+            self.release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(self.posts), 1)
+        self.assertEqual(len(set(r.url for r in results)), 1)
+
+    def test_convert_many(self):
+        client = FilepickerClient(api_key='APIKEY')
+        conversions = {'thumb': {'w': 100, 'storeLocation': 'S3'},
+                       'preview': {'w': 800}}
+        with self.api():
+            results = list(client.convert_many(['AAA', 'BBB'], conversions,
+                                               concurrency=2))
+
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(self.posts), 2)
+        for result in results:
+            file, name = result.item
+            self.assertIsNone(result.error)
+            self.assertIn(file.handle, result.result.url)
+            self.assertEqual(result.result.temporary, name == 'preview')
+
+
 class FilepickerClientTest(unittest2.TestCase):
 
     UPLOADED_FILE = {
@@ -197,6 +932,379 @@ class FilepickerClientTest(unittest2.TestCase):
         self.assertEqual(file.app_secret, self.client.app_secret)
 
 
+    def test_default_session(self):
+        self.assertIsInstance(self.client.session, FilepickerSession)
+        adapter = self.client.session.get_adapter(self.client.API_URL)
+        self.assertEqual(adapter._pool_maxsize,
+                         FilepickerSession.DEFAULT_POOL_MAXSIZE)
+
+        client = FilepickerClient(pool_connections=2, pool_maxsize=32)
+        adapter = client.session.get_adapter(client.API_URL)
+        self.assertEqual(adapter._pool_connections, 2)
+        self.assertEqual(adapter._pool_maxsize, 32)
+
+    def test_session_inheritance(self):
+        session = requests.Session()
+        client = FilepickerClient(api_key='SECRET_API_KEY', session=session)
+        self.assertIs(client.session, session)
+
+        @urlmatch(netloc=r'www\.filepicker\.io', path='/api', method='post',
+                  scheme='https')
+        def api_url(url, request):
+            return {'status_code': 200,
+                    'content': json.dumps(self.UPLOADED_FILE).encode('utf-8')}
+
+        with HTTMock(api_url):
+            file = client.store_from_url('filepicker.com/awesome.jpg')
+
+        self.assertIs(file.session, session)
+        self.assertIs(file.convert(w=10).session, session)
+
+
+    def test_store_local_file_streaming(self):
+        progress = []
+
+        @urlmatch(netloc=r'www\.filepicker\.io', path='/api', method='post',
+                  scheme='https')
+        def api_url(url, request):
+            self.assertIn('multipart/form-data; boundary=',
+                          request.headers['Content-Type'])
+            self.assertEqual(int(request.headers['Content-Length']),
+                             len(request.body))
+            body = b''.join(iter(lambda: request.body.read(1000), b''))
+            self.assertEqual(len(body), len(request.body))
+            with open(__file__, 'rb') as f:
+                self.assertIn(f.read(), body)
+            return {'status_code': 200,
+                    'content': json.dumps(self.UPLOADED_FILE).encode('utf-8')}
+
+        for use_mmap in (False, True):
+            with HTTMock(api_url):
+                file = self.client.store_local_file(
+                    __file__, use_mmap=use_mmap,
+                    progress_callback=lambda *args: progress.append(args))
+            self.assertIsInstance(file, FilepickerFile)
+            sent, total = progress[-1]
+            self.assertEqual(sent, total)
+            self.assertGreater(len(progress), 1)
+
+    def test_metadata_cache(self):
+        cache = LRUMetadataCache()
+        self.client.set_metadata_cache(cache)
+
+        @urlmatch(netloc=r'www\.filepicker\.io', path='/api', method='post',
+                  scheme='https')
+        def api_url(url, request):
+            return {'status_code': 200,
+                    'content': json.dumps(self.UPLOADED_FILE).encode('utf-8')}
+
+        with HTTMock(api_url):
+            file = self.client.store_from_url('filepicker.com/awesome.jpg')
+
+        cached = FilepickerFile(handle=file.handle, metadata_cache=cache)
+        self.assertEqual(cached.size, self.UPLOADED_FILE['size'])
+        self.assertEqual(cached.mimetype, self.UPLOADED_FILE['type'])
+        self.assertEqual(cache.hits, 1)
+
+        @all_requests
+        def delete_file(url, request):
+            return {'status_code': 200, 'content': b'success'}
+
+        with HTTMock(delete_file):
+            file.delete()
+
+        uncached = FilepickerFile(handle=file.handle, metadata_cache=cache)
+        self.assertEqual(uncached.metadata, {})
+        self.assertEqual(cache.misses, 1)
+
+    def test_fetch_metadata_many(self):
+
+        @urlmatch(netloc=r'www\.filepicker\.io', path='/api/file/',
+                  method='get', scheme='https')
+        def metadata_url(url, request):
+            handle = url.path.split('/')[3]
+            self.assertEqual(url.query, 'size=true')
+            if handle == 'broken':
+                raise requests.exceptions.ConnectionError('reset')
+            if handle == 'forbidden':
+                return {'status_code': 403, 'content': b'Invalid API key'}
+            return {'status_code': 200,
+                    'content': json.dumps({'size': len(handle)}).encode(
+                        'utf-8')}
+
+        self.client.session.retry_policy.sleep = lambda delay: None
+        existing = FilepickerFile(handle='existing')
+        handles = ['a', 'bb', 'broken', 'forbidden', existing]
+        with HTTMock(metadata_url):
+            results = list(self.client.fetch_metadata_many(
+                handles, fields=['size'], concurrency=3))
+
+        self.assertEqual(len(results), 5)
+        for result in results:
+            if result.item in ('broken', 'forbidden'):
+                self.assertIsNotNone(result.error)
+                continue
+            self.assertIsNone(result.error)
+            self.assertEqual(result.result.size, len(result.result.handle))
+        self.assertEqual(existing.size, len('existing'))
+        file = [r.result for r in results if r.item == 'a'][0]
+        self.assertEqual(file.api_key, self.client.api_key)
+
+    def test_store_bytes_and_streams(self):
+        server = LocalFilepickerServer().start()
+        self.client.API_URL = server.url + '/api'
+        png = b'\x89PNG\r\n\x1a\n' + b'x' * 5000
+
+        class Unseekable(object):
+            def __init__(self, data):
+                self.data = io.BytesIO(data)
+
+            def read(self, size=-1):
+                return self.data.read(size)
+
+        try:
+            file = self.client.store_bytes(memoryview(png))
+            self.assertEqual(file.handle, server.HANDLE)
+            body = server.requests[-1][2]
+            self.assertIn(png, body)
+            self.assertIn(b'Content-Type: image/png', body)
+            self.assertEqual(server.last_headers['Content-Length'],
+                             str(len(body)))
+
+            self.client.store_stream(io.BytesIO(b'%PDF-1.4 document'))
+            self.assertIn(b'Content-Type: application/pdf',
+                          server.requests[-1][2])
+            self.assertIn('Content-Length', server.last_headers)
+
+            self.client.store_stream(Unseekable(b'plain text' * 10000),
+                                     filename_hint='notes.txt')
+            body = server.requests[-1][2]
+            self.assertEqual(server.last_headers['Transfer-Encoding'],
+                             'chunked')
+            self.assertIn(b'plain text' * 10000, body)
+            self.assertIn(b'filename="notes.txt"', body)
+            self.assertIn(b'Content-Type: text/plain', body)
+
+            self.client.store_bytes(b'PK\x03\x04docx',
+                                    filename_hint='report.docx')
+            self.assertIn(b'Content-Type: application/vnd.openxmlformats-'
+                          b'officedocument.wordprocessingml.document',
+                          server.requests[-1][2])
+
+            file.overwrite(data=bytearray(b'new content'),
+                           mimetype='text/csv')
+            method, path, body = server.requests[-1]
+            self.assertEqual(path, '/api/file/' + server.HANDLE)
+            self.assertIn(b'Content-Type: text/csv\r\n\r\nnew content',
+                          body)
+        finally:
+            server.stop()
+
+    def test_dedup_uploads(self):
+        server = LocalFilepickerServer().start()
+        self.client.API_URL = server.url + '/api'
+        self.client.set_dedup_index(MemoryDedupIndex())
+        content = server.CONTENT
+        dest_path = 'delete_this_test_leftover'
+        with open(dest_path, 'wb') as f:
+            f.write(content)
+
+        class Unseekable(object):
+            def __init__(self, data):
+                self.data = io.BytesIO(data)
+
+            def read(self, size=-1):
+                return self.data.read(size)
+
+        def uploads():
+            return len([r for r in server.requests if r[0] == 'POST'])
+
+        try:
+            file = self.client.store_bytes(content)
+            self.assertEqual(uploads(), 1)
+            self.assertEqual(self.client.store_bytes(content).url, file.url)
+            duplicate = self.client.store_local_file(dest_path)
+            self.assertEqual(duplicate.url, file.url)
+            self.assertEqual(duplicate.md5, hashlib.md5(content).hexdigest())
+            self.assertEqual(uploads(), 1)
+
+            self.client.store_bytes(content, storage='azure')
+            self.client.store_bytes(content, dedup=False)
+            self.assertEqual(uploads(), 3)
+
+            self.client.store_stream(Unseekable(b'streamed' * 100))
+            self.client.store_bytes(b'streamed' * 100)
+            self.assertEqual(uploads(), 4)
+
+            self.client.dedup_verify = True
+            self.client.store_bytes(content)
+            self.assertEqual(uploads(), 4)
+            self.assertEqual(server.requests[-1][0], 'GET')
+            self.client.store_bytes(b'streamed' * 100)
+            self.assertEqual(uploads(), 5)
+            self.assertEqual(self.client.dedup_index.stats()['hits'], 5)
+        finally:
+            server.stop()
+            os.remove(dest_path)
+
+    def test_store_pipelined(self):
+        server = LocalFilepickerServer().start()
+        self.client.API_URL = server.url + '/api'
+        content = server.CONTENT
+        dest_path = 'delete_this_test_leftover'
+        with open(dest_path, 'wb') as f:
+            f.write(content)
+
+        try:
+            result = self.client.store_pipelined(
+                dest_path, hash_names=('md5', 'sha256'), chunk_size=100)
+            self.assertEqual(result.file.handle, server.HANDLE)
+            self.assertEqual(result.size, len(content))
+            self.assertEqual(result.digests['sha256'],
+                             hashlib.sha256(content).hexdigest())
+            self.assertIn(content, server.requests[-1][2])
+
+            result = self.client.store_pipelined(
+                dest_path, transform=GzipCompressor, chunk_size=100)
+            self.assertEqual(result.size, len(content))
+            self.assertEqual(result.digests['md5'],
+                             hashlib.md5(content).hexdigest())
+            self.assertEqual(server.last_headers.get('Transfer-Encoding'),
+                             'chunked')
+            self.assertNotIn(content, server.requests[-1][2])
+        finally:
+            server.stop()
+            os.remove(dest_path)
+
+    def test_store_many(self):
+
+        @urlmatch(netloc=r'www\.filepicker\.io', path='/api', method='post',
+                  scheme='https')
+        def api_url(url, request):
+            if hasattr(request.body, 'read'):
+                self.assertEqual(url.path, '/api/store/azure')
+            elif 'broken.jpg' in request.body:
+                raise requests.exceptions.ConnectionError('reset')
+            elif 'forbidden.jpg' in request.body:
+                return {'status_code': 403, 'content': b'Invalid API key'}
+            else:
+                self.assertEqual(url.path, '/api/store/S3')
+            return {'status_code': 200,
+                    'content': json.dumps(self.UPLOADED_FILE).encode('utf-8')}
+
+        items = ['filepicker.com/awesome.jpg',
+                 {'filepath': __file__, 'storage': 'azure'},
+                 {'url': 'filepicker.com/broken.jpg'},
+                 'filepicker.com/forbidden.jpg']
+        with HTTMock(api_url):
+            results = list(self.client.store_many(items, concurrency=2))
+
+        self.assertEqual(len(results), 4)
+        for result in results:
+            if result.item == items[2]:
+                self.assertIsNone(result.result)
+                self.assertIsInstance(result.error,
+                                      requests.exceptions.ConnectionError)
+            elif result.item == items[3]:
+                self.assertIsNone(result.result)
+                self.assertIsInstance(result.error, FilepickerException)
+            else:
+                self.assertIsNone(result.error)
+                self.assertIsInstance(result.result, FilepickerFile)
+
+    def test_migrate(self):
+        copied = []
+
+        @urlmatch(netloc=r'www\.filepicker\.io', path='/api/store/azure',
+                  method='post', scheme='https')
+        def api_url(url, request):
+            source = urllib.unquote(request.body.split('=', 1)[1])
+            handle = source.rsplit('/', 1)[1]
+            if handle == 'broken':
+                return {'status_code': 500, 'content': b'Internal error'}
+            self.assertIn('path=backup%2F' + handle, url.query)
+            copied.append(handle)
+            return {'status_code': 200, 'content': json.dumps(
+                {'url': FilepickerFile.FILE_API_URL + handle + 'copy'}
+            ).encode('utf-8')}
+
+        checkpoint_path = 'delete_this_test_leftover'
+        progress = []
+        self.client.session.retry_policy.sleep = lambda delay: None
+        try:
+            with HTTMock(api_url):
+                results = list(self.client.migrate(
+                    ['a', 'b', 'broken'], storage='azure',
+                    path=lambda file: 'backup/' + file.handle,
+                    checkpoint=checkpoint_path,
+                    progress_callback=lambda p: progress.append(
+                        (p.completed, p.failed))))
+                self.assertEqual(len(results), 3)
+                self.assertEqual(progress[-1], (2, 1))
+                failed = [r for r in results if r.error is not None]
+                self.assertEqual(failed[0].item.handle, 'broken')
+                self.assertIsInstance(failed[0].error, ValueError)
+
+                results = list(self.client.migrate(
+                    ['a', 'b', 'c'], storage='azure',
+                    path=lambda file: 'backup/' + file.handle,
+                    checkpoint=checkpoint_path))
+            self.assertEqual([r.item.handle for r in results], ['c'])
+            self.assertEqual(results[0].result.handle, 'ccopy')
+            self.assertEqual(sorted(copied), ['a', 'b', 'c'])
+            with Checkpoint(checkpoint_path) as checkpoint:
+                self.assertEqual(len(checkpoint), 3)
+                self.assertNotIn('broken', checkpoint)
+                self.assertEqual(checkpoint.done['c']['url'],
+                                 FilepickerFile.FILE_API_URL + 'ccopy')
+        finally:
+            os.remove(checkpoint_path)
+
+    def test_delete_many(self):
+        deleted = []
+
+        @urlmatch(netloc=r'www\.filepicker\.io', path='/api/file/',
+                  method='delete', scheme='https')
+        def delete_url(url, request):
+            handle = url.path.split('/')[3]
+            self.assertIn('key=SECRET_API_KEY', url.query)
+            deleted.append(handle)
+            status = {'gone': 404, 'forbidden': 403}.get(handle, 200)
+            return {'status_code': status, 'content': b''}
+
+        checkpoint_path = 'delete_this_test_leftover'
+        progress = []
+        try:
+            with HTTMock(delete_url):
+                results = list(self.client.delete_many(
+                    ['a', 'gone', 'forbidden'], concurrency=2,
+                    checkpoint=checkpoint_path,
+                    progress_callback=progress.append))
+                self.assertEqual(len(results), 3)
+                errors = dict((r.item.handle, r.error) for r in results)
+                self.assertIsNone(errors['a'])
+                self.assertIsNone(errors['gone'])
+                self.assertIsInstance(errors['forbidden'],
+                                      requests.exceptions.HTTPError)
+                self.assertEqual(progress[-1].completed, 2)
+                self.assertEqual(progress[-1].failed, 1)
+                self.assertGreater(progress[-1].throughput, 0)
+
+                results = list(self.client.delete_many(
+                    ['a', 'gone', 'forbidden', 'b'],
+                    checkpoint=checkpoint_path,
+                    progress_callback=progress.append))
+            self.assertEqual(sorted(r.item.handle for r in results),
+                             ['b', 'forbidden'])
+            self.assertEqual(progress[-1].skipped, 2)
+            self.assertEqual(sorted(deleted),
+                             ['a', 'b', 'forbidden', 'forbidden', 'gone'])
+            with open(checkpoint_path) as f:
+                self.assertEqual(len(f.readlines()), 3)
+        finally:
+            os.remove(checkpoint_path)
+
+
 class FilepickerFileTest(unittest2.TestCase):
 
     HANDLE = 'XXMadeUpHandleXX'
@@ -233,6 +1341,141 @@ class FilepickerFileTest(unittest2.TestCase):
         self.assertRaises(AttributeError,
                           file.__getattribute__, 'non_existent_attr')
 
+    def test_copy_to(self):
+        self.file = FilepickerFile(handle=self.HANDLE,
+                                   api_key='SECRET_API_KEY',
+                                   app_secret='APP_SECRET', policies={})
+        self.file.add_policy('read', {'expiry': 1})
+
+        @urlmatch(netloc=r'www\.filepicker\.io', path='/api/store/azure',
+                  method='post', scheme='https')
+        def api_url(url, request):
+            self.assertIn('key=SECRET_API_KEY', url.query)
+            self.assertIn('path=backups%2F', url.query)
+            source = urllib.unquote(request.body.split('=', 1)[1])
+            self.assertTrue(source.startswith(self.file.url + '?'))
+            self.assertIn('signature=', source)
+            return {'status_code': 200, 'content': json.dumps(
+                {'url': FilepickerFile.FILE_API_URL + 'CopiedHandle'}
+            ).encode('utf-8')}
+
+        with HTTMock(api_url):
+            copy = self.file.copy_to('azure', path='backups/',
+                                     source_policy='read')
+        self.assertEqual(copy.handle, 'CopiedHandle')
+        self.assertEqual(copy.api_key, 'SECRET_API_KEY')
+
+    def test_content_cache(self):
+        server = LocalFilepickerServer().start()
+        cache_dir = 'delete_this_test_leftover_cache'
+        dest_path = 'delete_this_test_leftover'
+        self.now = 1000
+        cache = ContentCache(cache_dir,
+                             max_size=len(server.CONTENT) * 2 - 1,
+                             revalidate_after=60, clock=lambda: self.now)
+        url = '{}/api/file/{}'.format(server.url, server.HANDLE)
+        file = FilepickerFile(url=url, content_cache=cache)
+
+        def downloads():
+            return [r for r in server.requests if r[0] == 'GET']
+
+        try:
+            self.assertEqual(file.download(dest_path).status_code, 200)
+            self.assertIsNone(file.download(dest_path))
+            with open(dest_path, 'rb') as f:
+                self.assertEqual(f.read(), server.CONTENT)
+            self.assertEqual(len(downloads()), 1)
+
+            self.now += 61
+            self.assertEqual(file.download(dest_path).status_code, 304)
+            self.assertIsNone(file.download(dest_path, verify=True))
+            self.assertEqual(cache.stats()['revalidated'], 1)
+            self.assertEqual(len(downloads()), 3)
+
+            cache.hardlink = True
+            file.download(dest_path)
+            self.assertEqual(os.stat(dest_path).st_ino,
+                             os.stat(cache.path(file.handle)).st_ino)
+            cache.hardlink = False
+
+            converted = file._derive(url=url + '/convert?w=10&signature=x',
+                                     temporary=True)
+            converted.download(dest_path)
+            self.assertEqual(cache.stats()['evictions'], 1)
+            self.assertEqual(len(ContentCache(cache_dir)._entries), 1)
+            file.download(dest_path)
+            self.assertEqual(cache.misses, 3)
+
+            file.md5 = 'mismatch'
+            self.assertRaises(ChecksumMismatch, file.download, dest_path)
+            self.assertFalse(os.path.exists(cache.path(file.handle)))
+        finally:
+            server.stop()
+            shutil.rmtree(cache_dir)
+            os.remove(dest_path)
+
+    def test_content_cache_invalidation(self):
+        server = LocalFilepickerServer().start()
+        cache_dir = 'delete_this_test_leftover_cache'
+        dest_path = 'delete_this_test_leftover'
+        cache = ContentCache(cache_dir)
+        url = '{}/api/file/{}'.format(server.url, server.HANDLE)
+        file = FilepickerFile(url=url, api_key='APIKEY', content_cache=cache)
+        file.md5 = hashlib.md5(server.CONTENT).hexdigest()
+
+        try:
+            file.download(dest_path)
+            server.CONTENT = b'new content'
+            file.overwrite(data=server.CONTENT)
+            self.assertIsNone(file.md5)
+            file.download(dest_path, verify=True)
+            with open(dest_path, 'rb') as f:
+                self.assertEqual(f.read(), b'new content')
+
+            file.delete()
+            self.assertFalse(os.path.exists(cache.path(file.handle)))
+            self.assertEqual(cache.stats()['entries'], 0)
+        finally:
+            server.stop()
+            shutil.rmtree(cache_dir)
+            os.remove(dest_path)
+
+    def test_download_pipelined(self):
+        server = LocalFilepickerServer().start()
+        dest_path = 'delete_this_test_leftover'
+        url = '{}/api/file/{}'.format(server.url, server.HANDLE)
+        file = FilepickerFile(url=url)
+
+        try:
+            result = file.download_pipelined(dest_path, chunk_size=100,
+                                             queue_size=1, verify=True)
+            self.assertEqual(result.size, len(server.CONTENT))
+            self.assertEqual(file.md5, result.digests['md5'])
+            with open(dest_path, 'rb') as f:
+                self.assertEqual(f.read(), server.CONTENT)
+
+            file.md5 = 'mismatch'
+            self.assertRaises(ChecksumMismatch, file.download_pipelined,
+                              dest_path, verify=True)
+
+            compressor = GzipCompressor()
+            server.CONTENT = (compressor(b'unzipped' * 100) +
+                              compressor.flush())
+            file.download_pipelined(dest_path, transform=GzipDecompressor)
+            with open(dest_path, 'rb') as f:
+                self.assertEqual(f.read(), b'unzipped' * 100)
+        finally:
+            server.stop()
+            os.remove(dest_path)
+
+    def test_metadata_attributes(self):
+        self.assertFalse(hasattr(self.file, '__dict__'))
+        self.assertRaises(AttributeError, setattr, self.file, 'foo', 1)
+        self.assertIsNone(self.file.size)
+        self.file.size = 10
+        self.assertEqual(self.file.metadata, {'size': 10})
+        self.assertEqual(self.file.size, 10)
+
     def test_set_api_key(self):
         self.assertEqual(self.file.api_key, None)
         self.file.set_api_key('my_key')
@@ -260,6 +1503,75 @@ class FilepickerFileTest(unittest2.TestCase):
 
         self.assertEqual(self.file.md5, '123abc')
 
+    def test_update_selected_metadata(self):
+        self.file.metadata['filename'] = 'a.png'
+
+        @urlmatch(netloc=r'www\.filepicker\.io',
+                  path='/api/file/{}/metadata'.format(self.HANDLE),
+                  method='get', scheme='https')
+        def metadata_url(url, request):
+            fields = sorted(q.split('=')[0] for q in url.query.split('&'))
+            self.assertEqual(fields, ['md5', 'size'])
+            return {'status_code': 200,
+                    'content': json.dumps({'md5': '123abc',
+                                           'size': 10}).encode('utf-8')}
+
+        with HTTMock(metadata_url):
+            self.file.update_metadata(fields=['size', 'md5'])
+
+        self.assertEqual(self.file.metadata,
+                         {'filename': 'a.png', 'md5': '123abc', 'size': 10})
+
+    def test_lazy_metadata(self):
+        requested = []
+
+        @urlmatch(netloc=r'www\.filepicker\.io',
+                  path='/api/file/{}/metadata'.format(self.HANDLE),
+                  method='get', scheme='https')
+        def metadata_url(url, request):
+            fields = sorted(q.split('=')[0] for q in url.query.split('&'))
+            requested.append(fields)
+            metadata = {'size': 10, 'mimetype': 'image/png', 'md5': 'abc'}
+            return {'status_code': 200,
+                    'content': json.dumps(dict(
+                        (f, metadata[f]) for f in fields
+                        if f in metadata)).encode('utf-8')}
+
+        file = FilepickerFile(handle=self.HANDLE, lazy=True)
+        with HTTMock(metadata_url):
+            self.assertEqual(file.size, 10)
+            self.assertEqual(file.size, 10)
+            self.assertIsNone(file.width)
+            self.assertIsNone(file.width)
+        self.assertEqual(requested, [['size'], ['width']])
+
+        del requested[:]
+        file = FilepickerFile(handle=self.HANDLE,
+                              lazy=['size', 'mimetype', 'md5'])
+        with HTTMock(metadata_url):
+            self.assertEqual(file.mimetype, 'image/png')
+            self.assertEqual(file.size, 10)
+            self.assertEqual(file.md5, 'abc')
+        self.assertEqual(requested, [['md5', 'mimetype', 'size']])
+
+    def test_lazy_metadata_failure(self):
+        statuses = [403, 200]
+
+        @urlmatch(netloc=r'www\.filepicker\.io',
+                  path='/api/file/{}/metadata'.format(self.HANDLE),
+                  method='get', scheme='https')
+        def metadata_url(url, request):
+            status = statuses.pop(0)
+            content = (b'Invalid API key' if status == 403 else
+                       json.dumps({'size': 10}).encode('utf-8'))
+            return {'status_code': status, 'content': content}
+
+        file = FilepickerFile(handle=self.HANDLE, lazy=True)
+        with HTTMock(metadata_url):
+            self.assertRaises(FilepickerException, getattr, file, 'size')
+            self.assertEqual(file.size, 10)
+        self.assertEqual(statuses, [])
+
     def test_delete(self):
 
         @urlmatch(netloc=r'www\.filepicker\.io',
@@ -343,6 +1655,103 @@ class FilepickerFileTest(unittest2.TestCase):
             print("Looks like something went wrong: {}".format(e))
             self.assertTrue(False)
 
+    def test_segmented_download(self):
+        dest_path = 'delete_this_test_leftover'
+        server = LocalFilepickerServer().start()
+        try:
+            file = FilepickerFile(
+                url='{}/api/file/{}'.format(server.url, server.HANDLE),
+                session=FilepickerSession())
+            file.download(dest_path, segments=3, chunk_size=100,
+                          verify=True)
+            with open(dest_path, 'rb') as f:
+                self.assertEqual(f.read(), server.CONTENT)
+            ranges = [r for m, p, r in server.requests if r]
+            self.assertEqual(len(ranges), 4)
+            self.assertFalse(os.path.exists(dest_path + '.fpdownload'))
+
+            file.metadata['md5'] = 'not the md5'
+            self.assertRaises(ChecksumMismatch, file.download, dest_path,
+                              segments=2, verify=True)
+
+            pwrite = getattr(os, 'pwrite', None)
+            if pwrite is not None:
+                del os.pwrite
+            try:
+                file.metadata.pop('md5')
+                file.download(dest_path, segments=4, chunk_size=10,
+                              verify=True)
+            finally:
+                if pwrite is not None:
+                    os.pwrite = pwrite
+            with open(dest_path, 'rb') as f:
+                self.assertEqual(f.read(), server.CONTENT)
+        finally:
+            server.stop()
+            os.remove(dest_path)
+
+    def test_stream_download(self):
+        server = LocalFilepickerServer().start()
+        content = server.CONTENT
+        md5 = hashlib.md5(content).hexdigest()
+        file = FilepickerFile(
+            url='{}/api/file/{}'.format(server.url, server.HANDLE),
+            session=FilepickerSession())
+        try:
+            hashers = {'sha256': hashlib.sha256()}
+            chunks = list(file.iter_bytes(chunk_size=100, hashers=hashers))
+            self.assertEqual(b''.join(chunks), content)
+            self.assertEqual(len(chunks[0]), 100)
+            self.assertEqual(hashers['sha256'].hexdigest(),
+                             hashlib.sha256(content).hexdigest())
+
+            out = io.BytesIO()
+            result = file.download_to(out, hash_names=('md5', 'sha1'))
+            self.assertEqual(out.getvalue(), content)
+            self.assertEqual(result.size, len(content))
+            self.assertEqual(result.digests['md5'], md5)
+            self.assertEqual(result.digests['sha1'],
+                             hashlib.sha1(content).hexdigest())
+
+            buf = bytearray(len(content) + 10)
+            result = file.read_into(buf, offset=10)
+            self.assertEqual(bytes(buf[10:]), content)
+            self.assertEqual(result.size, len(content))
+            self.assertEqual(result.digests['md5'], md5)
+
+            mapped = mmap.mmap(-1, len(content))
+            file.read_into(mapped, hash_names=())
+            self.assertEqual(mapped[:], content)
+            mapped.close()
+
+            self.assertRaises(FilepickerException, file.read_into,
+                              bytearray(10))
+        finally:
+            server.stop()
+
+    def test_resume_download(self):
+        dest_path = 'delete_this_test_leftover'
+        server = LocalFilepickerServer().start()
+        size = len(server.CONTENT)
+        url = '{}/api/file/{}'.format(server.url, server.HANDLE)
+        with open(dest_path, 'wb') as f:
+            f.write(server.CONTENT[:300])
+        with open(dest_path + '.fpdownload', 'w') as f:
+            json.dump({'source': url, 'size': size,
+                       'segments': [[0, 500, 300], [500, size, 0]]}, f)
+        try:
+            file = FilepickerFile(url=url, session=FilepickerSession())
+            file.download(dest_path, resume=True)
+            with open(dest_path, 'rb') as f:
+                self.assertEqual(f.read(), server.CONTENT)
+            ranges = sorted(r for m, p, r in server.requests if r)
+            self.assertEqual(ranges, ['bytes=300-499',
+                                      'bytes=500-{}'.format(size - 1)])
+            self.assertFalse(os.path.exists(dest_path + '.fpdownload'))
+        finally:
+            server.stop()
+            os.remove(dest_path)
+
     def test_overwrite(self):
 
         @all_requests
@@ -363,7 +1772,7 @@ class FilepickerFileTest(unittest2.TestCase):
         def overwrite_file(url, request):
             self.assertEqual(request.url, self.file.url)
             self.assertEqual(request.method, 'POST')
-            self.assertIn('name="fileUpload"', str(request.body))
+            self.assertIn(b'name="fileUpload"', request.body.read())
             j = {"url": "https://www.filepicker.io/api/file/ZXC",
                  "filename": "name.jpg"}
             return {'status_code': 200,
@@ -466,5 +1875,210 @@ class FilepickerFileTest(unittest2.TestCase):
                 r'{}.+policy.+'.format(self.file.url))
 
 
+
+class BenchmarkTest(unittest2.TestCase):
+
+    def test_benchmarks_run(self):
+        out = io.StringIO()
+        results = filepicker_benchmarks.main(
+            ['--operations', '4', '--concurrency', '1,2',
+             '--payload-size', '1024', '--json'], out=out)
+        self.assertEqual(
+            sorted(set(r['benchmark'] for r in results)),
+            ['convert', 'download', 'metadata', 'sign', 'sign_page',
+             'upload'])
+        self.assertEqual(len(results), 12)
+        for line, result in zip(out.getvalue().splitlines(), results):
+            self.assertEqual(json.loads(line), result)
+            self.assertGreater(result['ops_per_sec'], 0)
+            self.assertLessEqual(result['p50'], result['p99'])
+            if result['rss_growth'] is not None:
+                self.assertGreaterEqual(result['rss_growth'], 0)
+
+
+class CommandLineTest(unittest2.TestCase):
+
+    def setUp(self):
+        self.server = LocalFilepickerServer().start()
+        self.manifest = 'delete_this_test_leftover_manifest'
+        self.results = self.manifest + '.results.jsonl'
+        self.output_dir = 'delete_this_test_leftover_dir'
+        os.mkdir(self.output_dir)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.output_dir)
+        for path in (self.manifest, self.results):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write_manifest(self, lines):
+        with open(self.manifest, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def run_cli(self, command, *args):
+        out = io.StringIO() if str is not bytes else io.BytesIO()
+        argv = [command, self.manifest, '--api-key', 'SECRET_API_KEY',
+                '--api-url', self.server.url + '/api'] + list(args)
+        return filepicker_cli.main(argv, out=out), out.getvalue()
+
+    def read_results(self):
+        with open(self.results) as f:
+            return [json.loads(line) for line in f]
+
+    def requests(self, method):
+        return [r for r in self.server.requests if r[0] == method]
+
+    def test_upload_and_resume(self):
+        paths = [os.path.join(self.output_dir, str(i)) for i in range(5)]
+        for path in paths:
+            with open(path, 'wb') as f:
+                f.write(b'upload ' + path.encode('utf-8'))
+        self.write_manifest(paths + [
+            '# comment', '',
+            json.dumps({'url': 'http://example.com/a.jpg',
+                        'storage': 'azure'}),
+            json.dumps({'filepath': 'missing_file'})])
+
+        status, out = self.run_cli('upload', '--processes', '2',
+                                   '--batch-size', '2')
+        self.assertEqual(status, 1)
+        self.assertIn('6 completed, 1 failed, 0 skipped', out)
+        results = self.read_results()
+        self.assertEqual(len(results), 7)
+        self.assertEqual(len(self.requests('POST')), 6)
+        stored = [r for r in results if r['ok']]
+        self.assertTrue(all(r['url'].endswith(self.server.HANDLE)
+                            for r in stored))
+        self.assertIn('/api/store/azure',
+                      [r[1].split('?')[0] for r in self.requests('POST')])
+
+        status, out = self.run_cli('upload', '--processes', '1')
+        self.assertIn('0 completed, 1 failed, 6 skipped', out)
+        self.assertEqual(len(self.requests('POST')), 6)
+        self.assertEqual(self.read_results()[-1]['item'],
+                         {'filepath': 'missing_file'})
+
+    def test_download_delete_metadata(self):
+        url = '{}/api/file/{}'.format(self.server.url, self.server.HANDLE)
+        target = os.path.join(self.output_dir, 'named')
+        self.write_manifest([url, json.dumps({'url': url, 'path': target})])
+
+        status, out = self.run_cli('download', '--processes', '1',
+                                   '--output-dir', self.output_dir,
+                                   '--verify')
+        self.assertEqual(status, 0)
+        for path in (os.path.join(self.output_dir, self.server.HANDLE),
+                     target):
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), self.server.CONTENT)
+        os.remove(self.results)
+
+        self.assertEqual(self.run_cli('delete', '--processes', '2')[0], 0)
+        self.assertEqual(len(self.requests('DELETE')), 2)
+        os.remove(self.results)
+
+        self.write_manifest([self.server.HANDLE, 'Forbidden'])
+        status, out = self.run_cli('metadata', '--processes', '1',
+                                   '--fields', 'md5')
+        self.assertEqual(status, 1)
+        self.assertIn('1 completed, 1 failed', out)
+        results = dict((r['item'], r) for r in self.read_results())
+        self.assertEqual(results[self.server.HANDLE]['metadata']['md5'],
+                         hashlib.md5(self.server.CONTENT).hexdigest())
+        self.assertFalse(results['Forbidden']['ok'])
+        self.assertIn('403', results['Forbidden']['error'])
+
+
+@unittest2.skipIf(AsyncFilepickerClient is None, 'aiohttp is not installed')
+class AsyncFilepickerTest(unittest2.TestCase):
+
+    def setUp(self):
+        self.server = LocalFilepickerServer().start()
+        self.loop = asyncio.new_event_loop()
+        self.client = AsyncFilepickerClient(api_key='APIKEY')
+        self.client.API_URL = self.server.url + '/api'
+
+    def tearDown(self):
+        self.run_async(self.client.close())
+        self.loop.close()
+        self.server.stop()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_store_local_file(self):
+        file = self.run_async(self.client.store_local_file(__file__))
+
+        self.assertIsInstance(file, AsyncFilepickerFile)
+        self.assertEqual(file.handle, self.server.HANDLE)
+        self.assertGreater(file.size, os.path.getsize(__file__))
+        self.assertIs(file.session, self.client.session)
+        method, path, body = self.server.requests[-1]
+        self.assertIn('key=APIKEY', path)
+        self.assertIn(b'name="fileUpload"', body)
+
+    def test_store_from_url(self):
+        file = self.run_async(self.client.store_from_url('example.com/a.png',
+                                                         storage='azure'))
+        self.assertEqual(file.handle, self.server.HANDLE)
+        method, path, body = self.server.requests[-1]
+        self.assertTrue(path.startswith('/api/store/azure'))
+        self.assertIn(b'example.com', body)
+
+    def test_file_operations(self):
+        dest_path = 'delete_this_async_test_leftover'
+        file = self.run_async(self.client.store_from_url('example.com/a.png'))
+
+        self.run_async(file.update_metadata())
+        self.assertEqual(file.md5,
+                         hashlib.md5(self.server.CONTENT).hexdigest())
+
+        try:
+            self.run_async(file.download(dest_path, chunk_size=100))
+            with open(dest_path, 'rb') as f:
+                self.assertEqual(f.read(), self.server.CONTENT)
+        finally:
+            os.remove(dest_path)
+
+        response = self.run_async(file.delete())
+        self.assertEqual(response.status, 200)
+
+        converted = self.run_async(file.convert(w=20))
+        self.assertTrue(converted.temporary)
+        self.assertIs(converted.session, self.client.session)
+
+    def test_streaming_and_copy(self):
+        url = '{}/api/file/{}'.format(self.server.url, self.server.HANDLE)
+
+        files = []
+        self.loop.call_soon(lambda: files.append(AsyncFilepickerFile(
+            url=url, api_key='APIKEY', session=self.client.session)))
+        self.run_async(asyncio.sleep(0))
+        file = files[0]
+        output = io.BytesIO()
+        result = self.run_async(file.download_to(output, chunk_size=100))
+        self.assertEqual(output.getvalue(), self.server.CONTENT)
+        self.assertEqual(result.size, len(self.server.CONTENT))
+        self.assertEqual(result.digests['md5'],
+                         hashlib.md5(self.server.CONTENT).hexdigest())
+
+        AsyncFilepickerFile.STORE_API_URL = self.server.url + '/api/store/'
+        try:
+            copy = self.run_async(file.copy_to('azure', path='backup/'))
+        finally:
+            del AsyncFilepickerFile.STORE_API_URL
+        self.assertIsInstance(copy, AsyncFilepickerFile)
+        method, path, body = self.server.requests[-1]
+        self.assertTrue(path.startswith('/api/store/azure'))
+        self.assertIn('path=backup', path)
+
+        for method in (file.iter_bytes, file.read_into,
+                       file.download_pipelined):
+            self.assertRaises(FilepickerException, method, bytearray(10))
+        self.assertRaises(FilepickerException,
+                          Converter().convert, file, w=20)
+
+
 if __name__ == '__main__':
     unittest2.main()
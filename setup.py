@@ -15,7 +15,11 @@ setup(
     author='filepicker.io',
     author_email='support@filepicker.io',
     packages=find_packages(),
-    install_requires=['requests'],
+    install_requires=['requests', 'futures; python_version < "3.2"'],
+    extras_require={'async': ['aiohttp']},
+    entry_points={
+        'console_scripts': ['filepicker=filepicker.filepicker_cli:main'],
+    },
     classifiers=[
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers',